@@ -0,0 +1,267 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.authentication import aget_token
+from api.caching import aget_cached_list, get_data_version
+from api.filters import RecipeFilterBackend
+from api.pagination import CURSOR_PAGINATION, PAGINATION_QUERY_PARAM
+from api.serializers import (
+    IngredientSerializer,
+    RecipeSerializer,
+    TagSerializer,
+)
+from api.views import IngredientViewSet, RecipeViewSet, TagViewSet
+from recipes.autocomplete import ingredient_index
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from server.settings import DOMAIN
+
+
+AUTH_HEADER_KEYWORD = 'token'
+
+
+def async_read_view(read_handler, sync_view):
+    """Асинхронная обработка GET-запросов с запасным синхронным путем.
+
+    read_handler возвращает None, если запрос нужно передать обычному
+    представлению DRF: другие методы, ошибки авторизации, неверные
+    параметры и курсорная пагинация обрабатываются им.
+    """
+    sync_handler = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            response = await read_handler(request, *args, **kwargs)
+            if response is not None:
+                return response
+        return await sync_handler(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    # Имя набора и действия для учета запросов в server.instrumentation
+    view.cls = sync_view.cls
+    view.actions = sync_view.actions
+    return view
+
+
+def _json_response(data):
+    return HttpResponse(
+        JSONRenderer().render(data),
+        content_type='application/json'
+    )
+
+
+async def _aget_user(request):
+    """Пользователь по заголовку Authorization: Token <ключ>.
+
+    Возвращает None, если токен передан, но не найден или неактивен.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if not header or header[0].lower() != AUTH_HEADER_KEYWORD:
+        return AnonymousUser()
+    if len(header) != 2:
+        return None
+    found = await aget_token(header[1])
+    if found is None or not found[1]:
+        return None
+    return found[0].user
+
+
+def _cached_queryset(queryset, objects):
+    """QuerySet с уже загруженными объектами для кеша предвыборки."""
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    return queryset
+
+
+async def _aprefetch_recipes(recipes):
+    """Загрузка тегов и ингредиентов для списка рецептов.
+
+    В Django 4.2 асинхронные запросы не поддерживают prefetch_related,
+    поэтому связанные объекты загружаются двумя запросами и
+    раскладываются в кеш предвыборки рецептов.
+    """
+    recipes_by_id = {recipe.pk: recipe for recipe in recipes}
+    tags = {pk: [] for pk in recipes_by_id}
+    ingredients = {pk: [] for pk in recipes_by_id}
+    async for link in Recipe.tags.through.objects.filter(
+        recipe_id__in=recipes_by_id
+    ).select_related('tag').order_by('tag__name'):
+        tags[link.recipe_id].append(link.tag)
+    async for recipe_ingredient in RecipeIngredient.objects.filter(
+        recipe_id__in=recipes_by_id
+    ).select_related('ingredient').order_by('pk'):
+        ingredients[recipe_ingredient.recipe_id].append(recipe_ingredient)
+    for pk, recipe in recipes_by_id.items():
+        recipe._prefetched_objects_cache = {
+            'tags': _cached_queryset(Tag.objects.all(), tags[pk]),
+            'recipeingredient_set': _cached_queryset(
+                RecipeIngredient.objects.all(),
+                ingredients[pk]
+            ),
+        }
+
+
+async def _recipe_queryset(request):
+    """Рецепты с флагами пользователя и фильтрами из параметров запроса.
+
+    Как и в RecipeViewSet, фильтры применяются и к списку, и к
+    отдельному рецепту.
+    """
+    user = await _aget_user(request)
+    if user is None:
+        return None
+    request.user = user
+    drf_request = Request(request)
+    drf_request.user = user
+    return RecipeFilterBackend().filter_queryset(
+        drf_request,
+        Recipe.objects.select_related('author').defer(
+            'search_vector'
+        ).with_user_flags(user),
+        None
+    )
+
+
+async def recipe_list(request):
+    if request.GET.get(PAGINATION_QUERY_PARAM) == CURSOR_PAGINATION:
+        return None
+    queryset = await _recipe_queryset(request)
+    if queryset is None:
+        return None
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        return None
+    page_size = api_settings.PAGE_SIZE
+    count = await queryset.acount()
+    offset = (page - 1) * page_size
+    if page < 1 or (page > 1 and offset >= count):
+        return None
+    recipes = []
+    if count:
+        recipes = [
+            recipe async for recipe in queryset[offset:offset + page_size]
+        ]
+        await _aprefetch_recipes(recipes)
+
+    url = request.build_absolute_uri()
+    next_url = previous_url = None
+    if offset + page_size < count:
+        next_url = replace_query_param(url, 'page', page + 1)
+    if page == 2:
+        previous_url = remove_query_param(url, 'page')
+    elif page > 2:
+        previous_url = replace_query_param(url, 'page', page - 1)
+    return _json_response({
+        'count': count,
+        'next': next_url,
+        'previous': previous_url,
+        'results': RecipeSerializer(
+            recipes,
+            many=True,
+            context={'request': request}
+        ).data,
+    })
+
+
+async def recipe_detail(request, pk):
+    queryset = await _recipe_queryset(request)
+    if queryset is None:
+        return None
+    try:
+        recipe = await queryset.aget(pk=pk)
+    except Recipe.DoesNotExist:
+        return None
+    await _aprefetch_recipes([recipe])
+    return _json_response(
+        RecipeSerializer(recipe, context={'request': request}).data
+    )
+
+
+async def recipe_get_link(request, pk):
+    return _json_response({
+        'short-link': f'https://{DOMAIN}/recipes/{pk}/'
+    })
+
+
+async def tag_list(request):
+    if request.GET:
+        return None
+
+    async def load_tags():
+        return TagSerializer(
+            [tag async for tag in Tag.objects.all()],
+            many=True
+        ).data
+
+    return await aget_cached_list(request, 'tags', load_tags)
+
+
+async def ingredient_list(request):
+    name = request.GET.get('name')
+    if not name:
+        if request.GET:
+            return None
+
+        async def load_ingredients():
+            return IngredientSerializer(
+                [ingredient async for ingredient in Ingredient.objects.all()],
+                many=True
+            ).data
+
+        return await aget_cached_list(
+            request,
+            'ingredients',
+            load_ingredients
+        )
+    version = await sync_to_async(get_data_version)('ingredients')
+    ingredients = ingredient_index.search(
+        name,
+        settings.INGREDIENT_SEARCH_LIMIT,
+        version
+    )
+    if ingredients is None:
+        ingredient_index.build_in_background(version)
+        ingredients = [
+            ingredient async for ingredient
+            in Ingredient.objects.with_name_prefix(name)[
+                :settings.INGREDIENT_SEARCH_LIMIT
+            ]
+        ]
+    return _json_response(
+        IngredientSerializer(ingredients, many=True).data
+    )
+
+
+recipe_list_view = async_read_view(
+    recipe_list,
+    RecipeViewSet.as_view({'get': 'list', 'post': 'create'})
+)
+recipe_detail_view = async_read_view(
+    recipe_detail,
+    RecipeViewSet.as_view({
+        'get': 'retrieve',
+        'patch': 'partial_update',
+        'delete': 'destroy',
+    })
+)
+recipe_get_link_view = async_read_view(
+    recipe_get_link,
+    RecipeViewSet.as_view(
+        {'get': 'get_link'},
+        **RecipeViewSet.get_link.kwargs
+    )
+)
+tag_list_view = async_read_view(
+    tag_list,
+    TagViewSet.as_view({'get': 'list'})
+)
+ingredient_list_view = async_read_view(
+    ingredient_list,
+    IngredientViewSet.as_view({'get': 'list'})
+)
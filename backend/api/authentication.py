@@ -0,0 +1,229 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+
+from server.metrics import record_cache
+from server.replica import PRIMARY_DB, is_reading_replica
+
+
+User = get_user_model()
+
+TOKEN_CACHE_KEY = 'auth-token:{}'
+TOKEN_CACHE_NAME = 'auth_token'
+
+
+def _shared_key(key):
+    return TOKEN_CACHE_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+# Поля пользователя, которые читают сериализаторы и проверки прав.
+# Счетчики и уменьшенные копии аватара меняются через update() без
+# сигналов и в снимок не входят: они читаются из базы при обращении
+USER_SNAPSHOT_FIELDS = (
+    'id',
+    'email',
+    'username',
+    'first_name',
+    'last_name',
+    'avatar',
+    'is_active',
+    'is_staff',
+    'is_superuser',
+)
+# Изменение этих полей сбрасывает кеш токенов пользователя
+USER_TRACKED_FIELDS = USER_SNAPSHOT_FIELDS + ('password',)
+
+
+def _snapshot_user_fields():
+    # from_db ожидает значения в порядке полей модели
+    return [
+        field for field in User._meta.concrete_fields
+        if field.name in USER_SNAPSHOT_FIELDS
+    ]
+
+
+def _make_snapshot(token):
+    """Поля токена и поля пользователя из USER_SNAPSHOT_FIELDS."""
+    return (
+        token._state.db,
+        tuple(
+            field.value_from_object(token)
+            for field in Token._meta.concrete_fields
+        ),
+        # Аватар хранится именем файла, а не объектом FieldFile
+        tuple(
+            field.get_prep_value(field.value_from_object(token.user))
+            for field in _snapshot_user_fields()
+        ),
+    )
+
+
+def _restore(snapshot):
+    """Новые объекты токена и пользователя для каждого запроса.
+
+    Поля пользователя вне снимка отложены и читаются из базы при
+    обращении к ним, при save() они не перезаписываются.
+    """
+    db, token_values, user_values = snapshot
+    token = Token.from_db(
+        db,
+        [field.attname for field in Token._meta.concrete_fields],
+        token_values
+    )
+    token.user = User.from_db(
+        db,
+        [field.attname for field in _snapshot_user_fields()],
+        user_values
+    )
+    return token
+
+
+class TokenCache:
+    """LRU снимков токенов в памяти процесса с TTL.
+
+    Записи удаляются при удалении токена и изменении пользователя, но
+    только в текущем процессе: в памяти других воркеров снимок может
+    устареть не более чем на TOKEN_AUTH_CACHE_TIMEOUT. При
+    TOKEN_AUTH_SHARED_CACHE память процесса не используется, снимки
+    хранятся только в общем кеше, и отзыв токена виден всем воркерам
+    сразу.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, snapshot = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def set_local(self, key, snapshot):
+        with self._lock:
+            self._entries[key] = (
+                time.monotonic() + settings.TOKEN_AUTH_CACHE_TIMEOUT,
+                snapshot
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_AUTH_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if settings.TOKEN_AUTH_SHARED_CACHE:
+            cache.delete_many([_shared_key(key) for key in keys])
+
+    def get(self, key):
+        if settings.TOKEN_AUTH_SHARED_CACHE:
+            return cache.get(_shared_key(key))
+        return self.get_local(key)
+
+    async def aget(self, key):
+        if settings.TOKEN_AUTH_SHARED_CACHE:
+            return await cache.aget(_shared_key(key))
+        return self.get_local(key)
+
+    def set(self, key, snapshot):
+        if settings.TOKEN_AUTH_SHARED_CACHE:
+            cache.set(
+                _shared_key(key),
+                snapshot,
+                settings.TOKEN_AUTH_SHARED_CACHE_TIMEOUT
+            )
+        else:
+            self.set_local(key, snapshot)
+
+    async def aset(self, key, snapshot):
+        if settings.TOKEN_AUTH_SHARED_CACHE:
+            await cache.aset(
+                _shared_key(key),
+                snapshot,
+                settings.TOKEN_AUTH_SHARED_CACHE_TIMEOUT
+            )
+        else:
+            self.set_local(key, snapshot)
+
+
+token_cache = TokenCache()
+
+
+def get_token(key):
+    """Токен и активность пользователя из кеша или базы данных.
+
+    Токен, не найденный на реплике, ищется в основной базе. Возвращает
+    пару (токен, is_active) или None, если токена нет.
+    """
+    snapshot = token_cache.get(key)
+    record_cache(TOKEN_CACHE_NAME, snapshot is not None)
+    if snapshot is not None:
+        token = _restore(snapshot)
+        return token, token.user.is_active
+    queryset = Token.objects.select_related('user').filter(key=key)
+    token = queryset.first()
+    if token is None and is_reading_replica():
+        # Только что выданный токен может еще не дойти до реплики
+        token = queryset.using(PRIMARY_DB).first()
+    if token is None:
+        return None
+    token_cache.set(key, _make_snapshot(token))
+    return token, token.user.is_active
+
+
+async def aget_token(key):
+    """Асинхронный вариант get_token."""
+    snapshot = await token_cache.aget(key)
+    record_cache(TOKEN_CACHE_NAME, snapshot is not None)
+    if snapshot is not None:
+        token = _restore(snapshot)
+        return token, token.user.is_active
+    queryset = Token.objects.select_related('user').filter(key=key)
+    token = await queryset.afirst()
+    if token is None and is_reading_replica():
+        token = await queryset.using(PRIMARY_DB).afirst()
+    if token is None:
+        return None
+    await token_cache.aset(key, _make_snapshot(token))
+    return token, token.user.is_active
+
+
+def invalidate_tokens(keys):
+    """Удаление снимков токенов из кеша."""
+    keys = list(keys)
+    if keys:
+        token_cache.invalidate(keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену без запроса к базе при попадании в кеш.
+
+    Проверки и ответы совпадают с TokenAuthentication.
+    """
+
+    def authenticate_credentials(self, key):
+        found = get_token(key)
+        if found is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        token, is_active = found
+        if not is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return token.user, token
@@ -0,0 +1,78 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+
+from api.links import delete_links, insert_links
+
+
+User = get_user_model()
+
+CREATED = 'created'
+ALREADY_EXISTS = 'already_exists'
+DELETED = 'deleted'
+NOT_LINKED = 'not_linked'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def shift_counter(queryset, field, delta):
+    """Изменение счетчика на delta без ухода в отрицательные значения."""
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gt': 0})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def lock_user(user):
+    """Блокировка строки пользователя до конца текущей транзакции.
+
+    Одиночные и пакетные изменения связей одного пользователя
+    выполняются по очереди и не расходятся со счетчиками.
+    """
+    list(
+        User.objects.select_for_update().filter(
+            pk=user.pk
+        ).values_list('pk', flat=True)
+    )
+
+
+def bulk_link(user, ids, targets, link_model, target_field, add,
+              on_change, forbidden_ids=()):
+    """Пакетное добавление или удаление связей пользователя с объектами.
+
+    Связи link_model(user, target_field) создаются одним INSERT или
+    удаляются одним DELETE в одной транзакции, оба запроса возвращают
+    id фактически измененных связей. on_change(ids, sign) вызывается в
+    той же транзакции для этих id. Сигналы моделей не отправляются,
+    поэтому счетчики и итоги корзины обновляет on_change одним
+    запросом, а не обработчики сигналов по одной связи. Строка
+    пользователя блокируется через lock_user. Возвращает список
+    результатов по каждому id в порядке запроса.
+    """
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic():
+        lock_user(user)
+        found = set(
+            targets.filter(pk__in=ids).exclude(
+                pk__in=forbidden_ids
+            ).values_list('pk', flat=True)
+        )
+        target_ids = [target_id for target_id in ids if target_id in found]
+        change_links = insert_links if add else delete_links
+        changed = set(
+            change_links(link_model, target_field, target_ids, user=user.pk)
+        )
+        if changed:
+            on_change(changed, 1 if add else -1)
+
+    results = []
+    for target_id in ids:
+        if target_id in forbidden_ids:
+            outcome = FORBIDDEN
+        elif target_id not in found:
+            outcome = NOT_FOUND
+        elif target_id in changed:
+            outcome = CREATED if add else DELETED
+        else:
+            outcome = ALREADY_EXISTS if add else NOT_LINKED
+        results.append({'id': target_id, 'status': outcome})
+    return results
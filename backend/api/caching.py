@@ -0,0 +1,114 @@
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework.renderers import JSONRenderer
+
+from server.metrics import record_cache
+
+
+DATA_VERSION_KEY = 'data-version:{}'
+LIST_CACHE_KEY = 'list:{}:{}'
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_cache_shared():
+    """Общий ли кеш по умолчанию для всех процессов.
+
+    Версии данных справочников хранятся в кеше, в кеше памяти процесса
+    их смена не видна другим воркерам и командам управления.
+    """
+    return (
+        settings.CACHES['default']['BACKEND']
+        not in PROCESS_LOCAL_CACHE_BACKENDS
+    )
+
+
+def get_data_version(namespace):
+    """Текущая версия данных справочника."""
+    key = DATA_VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_data_version(namespace):
+    """Смена версии данных, ранее закешированные ответы устаревают."""
+    key = DATA_VERSION_KEY.format(namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def _make_cache_entry(data):
+    """Готовый JSON списка и его ETag."""
+    content = JSONRenderer().render(data)
+    etag = '"{}"'.format(
+        hashlib.md5(content, usedforsecurity=False).hexdigest()
+    )
+    return etag, content
+
+
+def _cached_response(request, etag, content):
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(
+            content,
+            content_type='application/json'
+        )
+    response.headers['ETag'] = etag
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=settings.REFERENCE_CACHE_MAX_AGE,
+    )
+    return response
+
+
+async def aget_cached_list(request, namespace, load_data):
+    """Асинхронная выдача закешированного списка справочника.
+
+    load_data - корутина, возвращающая сериализованный список.
+    """
+    version = await sync_to_async(get_data_version)(namespace)
+    key = LIST_CACHE_KEY.format(namespace, version)
+    cached = await cache.aget(key)
+    record_cache(namespace, cached is not None)
+    if cached is None:
+        cached = _make_cache_entry(await load_data())
+        await cache.aset(key, cached, settings.REFERENCE_CACHE_TIMEOUT)
+    return _cached_response(request, *cached)
+
+
+class CachedListMixin:
+    """Кеширование полного списка объектов в виде готового JSON.
+
+    Ключ кеша включает версию данных, которая меняется при сохранении
+    и удалении объектов, поэтому устаревшие ответы не отдаются.
+    """
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        key = LIST_CACHE_KEY.format(
+            self.cache_namespace,
+            get_data_version(self.cache_namespace)
+        )
+        cached = cache.get(key)
+        record_cache(self.cache_namespace, cached is not None)
+        if cached is None:
+            response = super().list(request, *args, **kwargs)
+            cached = _make_cache_entry(response.data)
+            cache.set(key, cached, settings.REFERENCE_CACHE_TIMEOUT)
+        return _cached_response(request, *cached)
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+from api.caching import is_cache_shared
+from server.replica import REPLICA_DB
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Предупреждение о кеше в памяти процесса при развертывании."""
+    if is_cache_shared():
+        return []
+    return [Warning(
+        'Кеш по умолчанию хранится в памяти процесса.',
+        hint=(
+            'Задайте CACHE_BACKEND, общий для воркеров и команд '
+            'управления, например RedisCache или DatabaseCache. Иначе '
+            'изменения справочников из других процессов, в том числе '
+            'load_ingredients и load_tags, видны воркерам только через '
+            'REFERENCE_CACHE_TIMEOUT и INGREDIENT_INDEX_TTL секунд, а '
+            'лента подписок строится запросом к базе при каждом чтении.'
+        ),
+        id='api.W001',
+    )]
+
+
+@register(Tags.database, deploy=True)
+def check_replica_cache(app_configs, **kwargs):
+    """Реплика для чтения требует общего кеша."""
+    if REPLICA_DB not in settings.DATABASES or is_cache_shared():
+        return []
+    return [Error(
+        'Реплика для чтения задана при кеше в памяти процесса.',
+        hint=(
+            'Закрепление клиента за основной базой после записи хранится '
+            'в кеше и должно быть видно всем воркерам. Задайте общий '
+            'CACHE_BACKEND, иначе все запросы читают из основной базы.'
+        ),
+        id='api.E001',
+    )]
@@ -0,0 +1,53 @@
+import threading
+from collections import Counter
+
+from django.db import connections
+
+from server.metrics import (
+    db_connections_opened,
+    db_pool_connections,
+    registry,
+)
+from server.postgresql_pool.base import get_pool_stats
+
+
+_opened = Counter()
+_opened_lock = threading.Lock()
+
+
+def count_opened_connection(alias):
+    with _opened_lock:
+        _opened[alias] += 1
+    db_connections_opened.inc(alias=alias)
+
+
+@registry.register_collector
+def collect_pool_stats():
+    for alias in connections:
+        stats = get_pool_stats(alias)
+        if stats is not None:
+            for state in ('in_use', 'idle'):
+                db_pool_connections.set(
+                    stats[state],
+                    alias=alias,
+                    state=state
+                )
+
+
+def get_connection_stats():
+    """Соединения с базами данных, открытые текущим процессом.
+
+    Для бэкенда с пулом добавляется состояние пула.
+    """
+    return {
+        alias: {
+            'vendor': connections[alias].vendor,
+            'conn_max_age': connections[alias].settings_dict['CONN_MAX_AGE'],
+            'health_checks': (
+                connections[alias].settings_dict['CONN_HEALTH_CHECKS']
+            ),
+            'opened': _opened[alias],
+            'pool': get_pool_stats(alias),
+        }
+        for alias in connections
+    }
@@ -0,0 +1,148 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.caching import is_cache_shared
+from identity.models import Subscription
+from recipes.models import Recipe
+from server.metrics import record_cache
+
+
+FEED_CACHE_KEY = 'feed:{}'
+FANOUT_BATCH_SIZE = 500
+
+
+def _feed_key(user_id):
+    return FEED_CACHE_KEY.format(user_id)
+
+
+def _entries(recipes, limit):
+    """Не более limit записей ленты (время публикации, id) по убыванию."""
+    return [
+        (pub_date.timestamp(), recipe_id)
+        for pub_date, recipe_id in recipes.order_by(
+            '-pub_date',
+            '-id'
+        ).values_list('pub_date', 'id')[:limit]
+    ]
+
+
+def is_popular_author(followers_count):
+    return followers_count >= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def _followed_authors(user_id, popular):
+    lookup = (
+        'author__followers_count__gte' if popular
+        else 'author__followers_count__lt'
+    )
+    return Subscription.objects.filter(**{
+        'user_id': user_id,
+        lookup: settings.FEED_FANOUT_MAX_FOLLOWERS,
+    }).values('author_id')
+
+
+def _build_feed(user_id):
+    """Лента из последних рецептов авторов с рассылкой при записи."""
+    return _entries(
+        Recipe.objects.filter(
+            author_id__in=_followed_authors(user_id, popular=False)
+        ),
+        settings.FEED_MAX_LENGTH
+    )
+
+
+def invalidate_feed(user_id):
+    """Сброс ленты, она будет построена заново при следующем чтении."""
+    cache.delete(_feed_key(user_id))
+
+
+def _update_follower_feeds(author_id, update):
+    """Изменение построенных лент подписчиков автора функцией update."""
+    follower_ids = Subscription.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True).iterator(
+        chunk_size=FANOUT_BATCH_SIZE
+    )
+    while True:
+        batch = list(islice(follower_ids, FANOUT_BATCH_SIZE))
+        if not batch:
+            return
+        feeds = cache.get_many([_feed_key(user_id) for user_id in batch])
+        for entries in feeds.values():
+            update(entries)
+        cache.set_many(feeds, settings.FEED_CACHE_TIMEOUT)
+
+
+def fan_out_recipe(recipe):
+    """Добавление нового рецепта в ленты подписчиков автора.
+
+    Рецепты популярных авторов в ленты не записываются и подмешиваются
+    при чтении. Обновляются только уже построенные ленты, остальные
+    будут построены при первом чтении. Обновление ленты не атомарно:
+    при одновременной записи добавленный рецепт может пропасть из ленты
+    до ее пересборки по истечении FEED_CACHE_TIMEOUT.
+    """
+    if not is_cache_shared() or is_popular_author(
+        recipe.author.followers_count
+    ):
+        return
+    entry = (recipe.pub_date.timestamp(), recipe.pk)
+
+    def add_entry(entries):
+        entries.append(entry)
+        entries.sort(reverse=True)
+        del entries[settings.FEED_MAX_LENGTH:]
+
+    _update_follower_feeds(recipe.author_id, add_entry)
+
+
+def remove_recipe_from_feeds(author_id, recipe_id):
+    """Удаление рецепта из построенных лент подписчиков автора."""
+    if not is_cache_shared():
+        return
+
+    def remove_entry(entries):
+        entries[:] = [entry for entry in entries if entry[1] != recipe_id]
+
+    _update_follower_feeds(author_id, remove_entry)
+
+
+def get_feed_page(user, offset, limit):
+    """id рецептов страницы ленты и признак наличия следующей страницы.
+
+    Лента подписок на обычных авторов читается из кеша, последние
+    рецепты популярных авторов запрашиваются одним запросом с LIMIT
+    и сливаются с ней, поэтому стоимость чтения зависит от размера
+    страницы, а не от числа подписок. Рассылка и сброс лент видны
+    всем воркерам только через общий кеш, с кешем в памяти процесса
+    лента каждый раз строится запросом к базе.
+    """
+    end = min(offset + limit, settings.FEED_MAX_LENGTH)
+    if is_cache_shared():
+        key = _feed_key(user.pk)
+        entries = cache.get(key)
+        record_cache('feed', entries is not None)
+        if entries is None:
+            entries = _build_feed(user.pk)
+            cache.set(key, entries, settings.FEED_CACHE_TIMEOUT)
+    else:
+        entries = _build_feed(user.pk)
+    pulled = _entries(
+        Recipe.objects.filter(
+            author_id__in=_followed_authors(user.pk, popular=True)
+        ),
+        end + 1
+    )
+    recipe_ids = []
+    for _, recipe_id in heapq.merge(entries, pulled, reverse=True):
+        if recipe_id not in recipe_ids[-1:]:
+            recipe_ids.append(recipe_id)
+        if len(recipe_ids) > end:
+            break
+    has_next = (
+        len(recipe_ids) > end and end < settings.FEED_MAX_LENGTH
+    )
+    return recipe_ids[offset:end], has_next
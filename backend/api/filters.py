@@ -0,0 +1,56 @@
+from django.db.models import Exists, OuterRef
+from rest_framework.filters import BaseFilterBackend
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+
+TRUE_VALUES = ('1', 'true', 'True')
+
+
+class RecipeFilterBackend(BaseFilterBackend):
+    """Фильтрация рецептов по автору, тегам, избранному, корзине и поиск.
+
+    Условия по связанным таблицам строятся как коррелированные EXISTS,
+    поэтому выборка не размножает строки рецептов, не требует DISTINCT
+    и сохраняет сортировку по индексу (pub_date, id).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        user = request.user
+
+        author = params.get('author')
+        if author:
+            if not author.isdigit():
+                return queryset.none()
+            queryset = queryset.filter(author_id=author)
+
+        tags = params.getlist('tags')
+        if tags:
+            queryset = queryset.filter(Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe_id=OuterRef('pk'),
+                    tag__slug__in=tags,
+                )
+            ))
+
+        if user.is_authenticated:
+            if params.get('is_favorited') in TRUE_VALUES:
+                queryset = queryset.filter(Exists(
+                    Favorite.objects.filter(
+                        user=user,
+                        recipe_id=OuterRef('pk'),
+                    )
+                ))
+            if params.get('is_in_shopping_cart') in TRUE_VALUES:
+                queryset = queryset.filter(Exists(
+                    ShoppingCart.objects.filter(
+                        user=user,
+                        recipe_id=OuterRef('pk'),
+                    )
+                ))
+
+        search = params.get('search', '').strip()
+        if search:
+            queryset = queryset.search(search)
+        return queryset
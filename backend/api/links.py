@@ -0,0 +1,131 @@
+from django.db import connections, router
+from django.db.models.signals import post_save
+
+
+def insert_link(link_model, **values):
+    """Создание связи одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Повторная связь отсекается уникальным ограничением модели, поэтому
+    одновременные запросы не приводят к IntegrityError. Как и
+    Model.save(), для созданной связи отправляет post_save. Возвращает
+    id созданной строки или None, если такая связь уже есть.
+    """
+    meta = link_model._meta
+    connection = connections[router.db_for_write(link_model)]
+    quote_name = connection.ops.quote_name
+    fields = [meta.get_field(name) for name in values]
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES ({placeholders}) '
+        'ON CONFLICT DO NOTHING RETURNING {pk}'
+    ).format(
+        table=quote_name(meta.db_table),
+        columns=', '.join(quote_name(field.column) for field in fields),
+        placeholders=', '.join(['%s'] * len(fields)),
+        pk=quote_name(meta.pk.column),
+    )
+    params = [
+        field.get_db_prep_save(value, connection)
+        for field, value in zip(fields, values.values())
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    instance = link_model(pk=row[0], **{
+        field.attname: value for field, value in zip(fields, values.values())
+    })
+    instance._state.adding = False
+    instance._state.db = connection.alias
+    post_save.send(
+        sender=link_model,
+        instance=instance,
+        created=True,
+        update_fields=None,
+        raw=False,
+        using=connection.alias
+    )
+    return row[0]
+
+
+def _execute_returning(link_model, sql, params):
+    connection = connections[router.db_for_write(link_model)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _link_columns(link_model, target_field, values):
+    """Поля связи: сначала поля из values, последним target_field."""
+    meta = link_model._meta
+    return (
+        [meta.get_field(name) for name in values],
+        meta.get_field(target_field)
+    )
+
+
+def insert_links(link_model, target_field, target_ids, **values):
+    """Создание связей с target_ids одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Сигналы не отправляются. Возвращает id объектов target_field, связь
+    с которыми создана этим запросом: уже существующие связи, в том
+    числе вставленные параллельно, в результат не попадают.
+    """
+    if not target_ids:
+        return []
+    connection = connections[router.db_for_write(link_model)]
+    quote_name = connection.ops.quote_name
+    fields, target = _link_columns(link_model, target_field, values)
+    row_params = [
+        field.get_db_prep_save(value, connection)
+        for field, value in zip(fields, values.values())
+    ]
+    row = '({})'.format(', '.join(['%s'] * (len(fields) + 1)))
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES {rows} '
+        'ON CONFLICT DO NOTHING RETURNING {target}'
+    ).format(
+        table=quote_name(link_model._meta.db_table),
+        columns=', '.join(
+            quote_name(field.column) for field in fields + [target]
+        ),
+        rows=', '.join([row] * len(target_ids)),
+        target=quote_name(target.column),
+    )
+    params = []
+    for target_id in target_ids:
+        params.extend(row_params)
+        params.append(target.get_db_prep_save(target_id, connection))
+    return _execute_returning(link_model, sql, params)
+
+
+def delete_links(link_model, target_field, target_ids, **values):
+    """Удаление связей с target_ids одним DELETE ... RETURNING.
+
+    Сигналы не отправляются. Возвращает id объектов target_field,
+    связь с которыми удалена этим запросом.
+    """
+    if not target_ids:
+        return []
+    connection = connections[router.db_for_write(link_model)]
+    quote_name = connection.ops.quote_name
+    fields, target = _link_columns(link_model, target_field, values)
+    sql = (
+        'DELETE FROM {table} WHERE {conditions} AND {target} IN ({ids}) '
+        'RETURNING {target}'
+    ).format(
+        table=quote_name(link_model._meta.db_table),
+        conditions=' AND '.join(
+            f'{quote_name(field.column)} = %s' for field in fields
+        ),
+        target=quote_name(target.column),
+        ids=', '.join(['%s'] * len(target_ids)),
+    )
+    params = [
+        field.get_db_prep_save(value, connection)
+        for field, value in zip(fields, values.values())
+    ] + [
+        target.get_db_prep_save(target_id, connection)
+        for target_id in target_ids
+    ]
+    return _execute_returning(link_model, sql, params)
@@ -0,0 +1,266 @@
+import json
+import platform
+import random
+import statistics
+import time
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Tag
+
+
+User = get_user_model()
+
+DEFAULT_REQUESTS = 50
+DEFAULT_WARMUP = 5
+DEFAULT_TOLERANCE = 0.25
+INGREDIENT_PREFIX_LENGTH = 2
+
+
+def percentile(values, percent):
+    """Перцентиль с линейной интерполяцией."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (
+        position - lower
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер задержек и числа SQL-запросов основных эндпоинтов API '
+        'внутри процесса'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=DEFAULT_REQUESTS,
+            help='Количество замеряемых запросов на сценарий',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=DEFAULT_WARMUP,
+            help='Количество прогревочных запросов на сценарий',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            dest='scenarios',
+            help='Запустить только указанные сценарии',
+        )
+        parser.add_argument(
+            '--report',
+            help='Путь к JSON-отчету',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Путь к JSON-отчету для сравнения',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=DEFAULT_TOLERANCE,
+            help='Допустимый рост p95 относительно базового отчета',
+        )
+
+    def _auth_client(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def _scenarios(self):
+        """Сценарии: имя, клиент и функция, возвращающая URL запроса."""
+        rng = self.rng
+        follower = User.objects.annotate(
+            subscriptions=Count('follower')
+        ).order_by('-subscriptions').first()
+        buyer = User.objects.annotate(
+            cart_size=Count('shopping_cart')
+        ).order_by('-cart_size').first()
+        if follower is None or buyer is None:
+            raise CommandError(
+                'Нет данных для замеров, выполните seed_benchmark'
+            )
+        author_ids = list(
+            User.objects.filter(recipes_count__gt=0).values_list(
+                'pk',
+                flat=True
+            )[:100]
+        )
+        tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        prefixes = sorted({
+            name[:INGREDIENT_PREFIX_LENGTH].lower()
+            for name in Ingredient.objects.values_list('name', flat=True)[
+                :1000
+            ]
+        })
+        anonymous = Client()
+        following = self._auth_client(follower)
+        shopping = self._auth_client(buyer)
+        return [
+            ('recipes_list', anonymous, lambda: '/api/recipes/'),
+            (
+                'recipes_page',
+                anonymous,
+                lambda: f'/api/recipes/?page={rng.randint(2, 20)}'
+            ),
+            (
+                'recipes_filter_tags',
+                following,
+                lambda: f'/api/recipes/?tags={rng.choice(tag_slugs)}'
+            ),
+            (
+                'recipes_filter_author',
+                following,
+                lambda: f'/api/recipes/?author={rng.choice(author_ids)}'
+            ),
+            (
+                'recipes_favorited',
+                following,
+                lambda: '/api/recipes/?is_favorited=1'
+            ),
+            ('subscriptions', following, lambda: '/api/users/subscriptions/'),
+            (
+                'ingredient_search',
+                anonymous,
+                lambda: f'/api/ingredients/?name={rng.choice(prefixes)}'
+            ),
+            (
+                'shopping_list',
+                shopping,
+                lambda: '/api/recipes/download_shopping_cart/'
+            ),
+        ]
+
+    def _request(self, client, url):
+        """Время выполнения запроса в мс, число SQL-запросов и статус."""
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connection))
+                for connection in connections.all()
+            ]
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        return (
+            elapsed,
+            sum(len(context) for context in contexts),
+            response.status_code
+        )
+
+    def _run_scenario(self, client, make_url, requests, warmup):
+        for _ in range(warmup):
+            self._request(client, make_url())
+        timings, queries, errors = [], [], 0
+        for _ in range(requests):
+            elapsed, query_count, status = self._request(client, make_url())
+            timings.append(elapsed)
+            queries.append(query_count)
+            if status >= 400:
+                errors += 1
+        return {
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries': max(queries),
+            'errors': errors,
+        }
+
+    def _compare(self, results, baseline, tolerance):
+        """Регрессии относительно базового отчета."""
+        regressions = []
+        for name, result in results.items():
+            base = baseline['scenarios'].get(name)
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                regressions.append(
+                    f'{name}: SQL-запросов {result["queries"]} '
+                    f'вместо {base["queries"]}'
+                )
+            if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: p95 {result["p95_ms"]} мс '
+                    f'вместо {base["p95_ms"]} мс'
+                )
+            if result['errors'] > base['errors']:
+                regressions.append(
+                    f'{name}: ошибок {result["errors"]}'
+                )
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests должно быть больше нуля')
+        self.rng = random.Random(options['seed'])
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(
+                    f'Не удалось прочитать базовый отчет: {error}'
+                )
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, client, make_url in self._scenarios():
+                if options['scenarios'] and name not in options['scenarios']:
+                    continue
+                results[name] = self._run_scenario(
+                    client,
+                    make_url,
+                    options['requests'],
+                    options['warmup']
+                )
+                result = results[name]
+                self.stdout.write(
+                    f'{name:<24} p50 {result["p50_ms"]:>8} мс  '
+                    f'p95 {result["p95_ms"]:>8} мс  '
+                    f'p99 {result["p99_ms"]:>8} мс  '
+                    f'запросов {result["queries"]:>3}  '
+                    f'ошибок {result["errors"]}'
+                )
+
+        report = {
+            'created': timezone.now().isoformat(),
+            'database': connections['default'].vendor,
+            'python': platform.python_version(),
+            'requests': options['requests'],
+            'scenarios': results,
+        }
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+        if baseline is not None:
+            regressions = self._compare(
+                results,
+                baseline,
+                options['tolerance']
+            )
+            if regressions:
+                raise CommandError(
+                    'Регрессии относительно базового отчета:\n'
+                    + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS(
+                'Регрессий относительно базового отчета нет'
+            ))
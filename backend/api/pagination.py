@@ -0,0 +1,49 @@
+from rest_framework.pagination import CursorPagination
+
+
+PAGINATION_QUERY_PARAM = 'pagination'
+CURSOR_PAGINATION = 'cursor'
+
+
+MAX_PAGE_SIZE = 100
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Курсорная пагинация рецептов от новых к старым.
+
+    Курсор хранит pub_date последнего рецепта страницы и смещение среди
+    рецептов с той же датой, id лишь упорядочивает такие рецепты.
+    """
+    ordering = ('-pub_date', '-id')
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class SubscriptionCursorPagination(CursorPagination):
+    """Курсорная пагинация подписок по id автора."""
+    ordering = ('id',)
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class OptionalCursorPaginationMixin:
+    """Переключение на курсорную пагинацию параметром pagination=cursor.
+
+    Курсорная пагинация не выполняет COUNT(*) и OFFSET, поэтому время
+    получения страницы не зависит от ее номера.
+    """
+    cursor_pagination_class = None
+    cursor_pagination_actions = ('list',)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if (
+                self.action in self.cursor_pagination_actions
+                and self.request.query_params.get(PAGINATION_QUERY_PARAM)
+                == CURSOR_PAGINATION
+            ):
+                self._paginator = self.cursor_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
@@ -1,15 +1,20 @@
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
 
 from rest_framework import serializers
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 
+from api.links import insert_link
 from identity.models import Subscription
+from server.instrumentation import SERIALIZER_TIMER, timer
 
 from recipes.models import (
     Ingredient,
     Recipe,
     RecipeIngredient,
+    ShoppingCartTotal,
     Tag,
 )
 
@@ -21,6 +26,44 @@ MAX_AMOUNT = 32000
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 32000
 MAX_RECIPES_IN_SUBSCRIPTION = 3
+MAX_BULK_IDS = 100
+
+
+def editable_field_names(model):
+    """Поля модели, которые меняют пользователи.
+
+    Счетчики и уменьшенные копии изображений не редактируются и
+    меняются через update() в обход экземпляра: сохранение только
+    редактируемых полей не возвращает их старые значения.
+    """
+    return [
+        field.name for field in model._meta.concrete_fields
+        if field.editable and not field.primary_key
+    ]
+
+
+class TimedRepresentationMixin:
+    """Учет времени сериализации в показателях текущего запроса."""
+
+    def to_representation(self, instance):
+        with timer(SERIALIZER_TIMER):
+            return super().to_representation(instance)
+
+
+class RenditionsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии изображения."""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for rendition, name in value.items():
+            if rendition == 'source':
+                continue
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[rendition] = url
+        return urls
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -40,10 +83,11 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         )
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedRepresentationMixin, UserSerializer):
     """Сериализатор для данных пользователя."""
     is_subscribed = serializers.SerializerMethodField()
     avatar = Base64ImageField(required=False, allow_null=True)
+    avatar_renditions = RenditionsField()
 
     class Meta:
         model = User
@@ -55,9 +99,19 @@ class CustomUserSerializer(UserSerializer):
             'last_name',
             'is_subscribed',
             'avatar',
+            'avatar_renditions',
         )
 
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # Полное сохранение вернуло бы старые значения счетчиков
+        instance.save(update_fields=list(validated_data))
+        return instance
+
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -65,10 +119,15 @@ class CustomUserSerializer(UserSerializer):
 
 
 class SubscriptionCreateSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания подписки."""
+    """Сериализатор для создания подписки.
+
+    Повторная подписка определяется уникальным ограничением при вставке,
+    а не предварительной проверкой.
+    """
     class Meta:
         model = Subscription
         fields = ('user', 'author')
+        validators = []
 
     def validate(self, data):
         user = data['user']
@@ -79,25 +138,46 @@ class SubscriptionCreateSerializer(serializers.ModelSerializer):
                 'Вы не можете подписаться на самого себя'
             )
 
-        if author.following.filter(user=user).exists():
+        return data
+
+    def create(self, validated_data):
+        subscription_id = insert_link(
+            Subscription,
+            user=validated_data['user'].pk,
+            author=validated_data['author'].pk
+        )
+        if subscription_id is None:
             raise serializers.ValidationError(
                 'Вы уже подписаны на этого пользователя'
             )
+        return Subscription(pk=subscription_id, **validated_data)
 
-        return data
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Сериализатор списка id для пакетных операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_IDS,
+    )
 
 
-class SubscriptionRecipeSerializer(serializers.ModelSerializer):
+class SubscriptionRecipeSerializer(
+    TimedRepresentationMixin,
+    serializers.ModelSerializer
+):
     """Сериализатор для рецептов в подписках."""
+    image_renditions = RenditionsField()
+
     class Meta:
         model = Recipe
-        fields = ('__all__')
+        fields = ('id', 'name', 'image', 'image_renditions', 'cooking_time')
 
 
 class SubscriptionSerializer(CustomUserSerializer):
     """Сериализатор для подписок."""
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(CustomUserSerializer.Meta):
         fields = CustomUserSerializer.Meta.fields + ('recipes',
@@ -105,19 +185,25 @@ class SubscriptionSerializer(CustomUserSerializer):
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes = obj.recipes.all()[:MAX_RECIPES_IN_SUBSCRIPTION]
+        if hasattr(obj, 'preview_recipes'):
+            recipes = obj.preview_recipes
+        else:
+            recipes_limit = self.context.get(
+                'recipes_limit',
+                MAX_RECIPES_IN_SUBSCRIPTION
+            )
+            recipes = obj.recipes.all()[:recipes_limit]
         return SubscriptionRecipeSerializer(
             recipes,
             many=True,
             context={'request': request}
         ).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """Сериализатор для пользователей."""
+    avatar_renditions = RenditionsField()
+
     class Meta:
         model = User
         fields = (
@@ -126,18 +212,22 @@ class UserSerializer(serializers.ModelSerializer):
             'email',
             'first_name',
             'last_name',
-            'avatar'
+            'avatar',
+            'avatar_renditions'
         )
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """Сериализатор для тегов."""
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    TimedRepresentationMixin,
+    serializers.ModelSerializer
+):
     """Сериализатор для ингредиентов."""
     class Meta:
         model = Ingredient
@@ -156,14 +246,32 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'amount']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeIngredientReadSerializer(serializers.ModelSerializer):
+    """Сериализатор для ингредиентов рецепта с количеством."""
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = RecipeIngredient
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class RecipeSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """Сериализатор для рецептов."""
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
-    ingredients = IngredientSerializer(many=True, read_only=True)
+    ingredients = RecipeIngredientReadSerializer(
+        source='recipeingredient_set',
+        many=True,
+        read_only=True
+    )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_renditions = RenditionsField()
 
     class Meta:
         model = Recipe
@@ -176,17 +284,22 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_renditions',
             'text',
             'cooking_time'
         )
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
         return obj.favorites.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -231,6 +344,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ]
         RecipeIngredient.objects.bulk_create(recipe_ingredients)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
@@ -240,18 +354,67 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         self._create_recipe_ingredients(recipe, ingredients_data)
         return recipe
 
+    def _update_recipe_ingredients(self, recipe, ingredients_data):
+        """Изменение ингредиентов рецепта по разнице с сохраненными.
+
+        Изменяются только строки с другим количеством, новые добавляются,
+        отсутствующие в запросе удаляются. Возвращает изменения количества
+        по id ингредиента.
+        """
+        existing = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipeingredient_set.all()
+        }
+        to_create, to_update, deltas = [], [], {}
+        for ingredient in ingredients_data:
+            ingredient_id = ingredient['id'].id
+            amount = ingredient['amount']
+            recipe_ingredient = existing.pop(ingredient_id, None)
+            if recipe_ingredient is None:
+                to_create.append(RecipeIngredient(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                ))
+                deltas[ingredient_id] = amount
+            elif recipe_ingredient.amount != amount:
+                deltas[ingredient_id] = amount - recipe_ingredient.amount
+                recipe_ingredient.amount = amount
+                to_update.append(recipe_ingredient)
+        for ingredient_id, recipe_ingredient in existing.items():
+            deltas[ingredient_id] = -recipe_ingredient.amount
+        if existing:
+            RecipeIngredient.objects.filter(pk__in=[
+                recipe_ingredient.pk
+                for recipe_ingredient in existing.values()
+            ]).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+        return deltas
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         if 'ingredients' in validated_data:
-            ingredients_data = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self._create_recipe_ingredients(instance, ingredients_data)
+            deltas = self._update_recipe_ingredients(
+                instance,
+                validated_data.pop('ingredients')
+            )
+            if deltas:
+                ShoppingCartTotal.objects.apply_deltas(
+                    instance.shopping_cart.values_list('user_id', flat=True),
+                    deltas
+                )
         if 'tags' in validated_data:
             tags_data = validated_data.pop('tags')
             instance.tags.set(tags_data)
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save()
+        # Все редактируемые поля: post_save пересчитывает поисковый
+        # вектор и при изменении только ингредиентов
+        instance.save(update_fields=editable_field_names(Recipe))
         return instance
 
     def validate(self, data):
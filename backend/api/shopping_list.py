@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from recipes.models import ShoppingCartTotal
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+
+EXPORT_CHUNK_SIZE = 2000
+STREAM_BUFFER_SIZE = 8192
+SHOPPING_LIST_TITLE = 'Список покупок:'
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер формата выгрузки списка покупок.
+
+    Сам список отдается потоковым ответом, рендерер используется для
+    выбора формата по параметру format и для ответов с ошибками.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+def get_shopping_list_rows(user):
+    """Итоговое количество ингредиентов из корзины пользователя.
+
+    Строки упорядочены по единице измерения и читаются курсором
+    на стороне сервера порциями по EXPORT_CHUNK_SIZE.
+    """
+    return ShoppingCartTotal.objects.filter(
+        user=user
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount'
+    ).order_by(
+        'ingredient__measurement_unit',
+        'ingredient__name'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _buffered(chunks, size=STREAM_BUFFER_SIZE):
+    """Склейка мелких строк в блоки для отправки клиенту."""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def aiterate(chunks):
+    """Асинхронный обход блоков ответа для ASGI.
+
+    Синхронный итератор StreamingHttpResponse под ASGI сначала читается
+    целиком, поэтому ответ не отдается частями. Блоки читаются в потоке
+    запроса через sync_to_async, в нем же открыт курсор базы данных.
+    """
+    iterator = iter(chunks)
+    next_chunk = sync_to_async(next)
+    while True:
+        chunk = await next_chunk(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _text_lines(rows):
+    yield f'{SHOPPING_LIST_TITLE}\n'
+    current_unit = None
+    for row in rows:
+        unit = row['ingredient__measurement_unit']
+        if unit != current_unit:
+            current_unit = unit
+            yield f'\n{unit}:\n'
+        yield f'{row["ingredient__name"]} - {row["amount"]} {unit}\n'
+
+
+def _csv_lines(rows):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(('Единица измерения', 'Ингредиент', 'Количество'))
+    for row in rows:
+        writer.writerow((
+            row['ingredient__measurement_unit'],
+            row['ingredient__name'],
+            row['amount'],
+        ))
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+    if line.tell():
+        yield line.getvalue()
+
+
+def render_text(rows):
+    """Список покупок в виде текста, сгруппированный по единицам."""
+    return _buffered(_text_lines(rows))
+
+
+def render_csv(rows):
+    """Список покупок в формате CSV."""
+    return _buffered(_csv_lines(rows))
+
+
+def render_pdf(rows):
+    """Список покупок в формате PDF.
+
+    Документ собирается в памяти, поскольку формат PDF требует таблицы
+    ссылок в конце файла, строки при этом читаются курсором.
+    """
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT)
+        )
+    output = io.BytesIO()
+    document = canvas.Canvas(output, pagesize=A4)
+    _, height = A4
+    position = height - PDF_MARGIN
+    for line in _text_lines(rows):
+        for text in line.split('\n')[:-1]:
+            if position < PDF_MARGIN:
+                document.showPage()
+                position = height - PDF_MARGIN
+            document.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+            document.drawString(PDF_MARGIN, position, text)
+            position -= PDF_LINE_HEIGHT
+    document.save()
+    yield output.getvalue()
+
+
+EXPORT_FORMATS = {
+    'txt': (render_text, 'text/plain; charset=utf-8', 'shopping-list.txt'),
+    'csv': (render_csv, 'text/csv; charset=utf-8', 'shopping-list.csv'),
+    'pdf': (render_pdf, 'application/pdf', 'shopping-list.pdf'),
+}
+DEFAULT_EXPORT_FORMAT = 'txt'
+
+SHOPPING_LIST_RENDERERS = [
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+]
+if canvas is not None:
+    SHOPPING_LIST_RENDERERS.append(ShoppingListPDFRenderer)
@@ -0,0 +1,267 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import (
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from api.authentication import USER_TRACKED_FIELDS, invalidate_tokens
+from api.bulk import shift_counter
+from api.caching import bump_data_version
+from api.connections import count_opened_connection
+from api.feed import (
+    fan_out_recipe,
+    invalidate_feed,
+    remove_recipe_from_feeds,
+)
+from identity.models import Subscription
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Tag,
+)
+from recipes.signals import catalog_loaded
+
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(catalog_loaded, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_data_version('tags')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(catalog_loaded, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_data_version('ingredients')
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    count_opened_connection(connection.alias)
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(
+            User.objects.filter(pk=instance.author_id),
+            'recipes_count',
+            1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, origin=None, **kwargs):
+    # Счетчик удаляемого автора не нужен
+    if _origin_model(origin) is not User:
+        shift_counter(
+            User.objects.filter(pk=instance.author_id),
+            'recipes_count',
+            -1
+        )
+
+
+def _origin_model(origin):
+    """Модель объекта или QuerySet, у которого вызван delete()."""
+    if isinstance(origin, QuerySet):
+        return origin.model
+    return type(origin)
+
+
+def _origin_pks(origin):
+    if isinstance(origin, QuerySet):
+        return origin.values('pk')
+    return [origin.pk]
+
+
+def _cascaded_cart_items(origin):
+    """Строки чужих корзин, удаляемые каскадом вместе с origin.
+
+    Возвращает None, если origin не рецепт и не пользователь. Корзины
+    удаляемых пользователей не учитываются: их итоги удаляются вместе
+    с ними.
+    """
+    model = _origin_model(origin)
+    if model is Recipe:
+        return ShoppingCart.objects.filter(recipe__in=_origin_pks(origin))
+    if model is User:
+        pks = _origin_pks(origin)
+        return ShoppingCart.objects.filter(
+            recipe__author__in=pks
+        ).exclude(user__in=pks)
+    return None
+
+
+@receiver(post_save, sender=Favorite)
+def count_created_favorite(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            'favorites_count',
+            1
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+def count_deleted_favorite(sender, instance, origin=None, **kwargs):
+    if _origin_model(origin) is not Recipe:
+        shift_counter(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            'favorites_count',
+            -1
+        )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        ShoppingCartTotal.objects.add_recipes(
+            [instance.user_id],
+            [instance.recipe_id]
+        )
+        shift_counter(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            'in_carts_count',
+            1
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_cart_totals(sender, instance, origin=None, **kwargs):
+    """Исключение рецепта из итогов корзины до удаления.
+
+    При каскадном удалении рецепта его ингредиенты удаляются в той же
+    операции, а до удаления они еще есть. При удалении рецептов или их
+    автора итоги всех затронутых корзин пересчитываются один раз, при
+    первой строке корзины, а не запросами на каждую строку.
+    """
+    cart_items = _cascaded_cart_items(origin)
+    if cart_items is None:
+        ShoppingCartTotal.objects.add_recipes(
+            [instance.user_id],
+            [instance.recipe_id],
+            sign=-1
+        )
+        return
+    if not getattr(origin, '_cart_totals_removed', False):
+        origin._cart_totals_removed = True
+        ShoppingCartTotal.objects.remove_cart_items(cart_items)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def count_deleted_cart_item(sender, instance, origin=None, **kwargs):
+    # Счетчик удаляемого рецепта не нужен
+    if _origin_model(origin) is not Recipe:
+        shift_counter(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            'in_carts_count',
+            -1
+        )
+
+
+@receiver(post_save, sender=Subscription)
+def count_created_subscription(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(
+            User.objects.filter(pk=instance.author_id),
+            'followers_count',
+            1
+        )
+
+
+@receiver(post_delete, sender=Subscription)
+def count_deleted_subscription(sender, instance, **kwargs):
+    shift_counter(
+        User.objects.filter(pk=instance.author_id),
+        'followers_count',
+        -1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: fan_out_recipe(instance))
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_from_feeds(sender, instance, **kwargs):
+    # После удаления первичный ключ экземпляра обнуляется
+    author_id, recipe_id = instance.author_id, instance.pk
+    transaction.on_commit(
+        lambda: remove_recipe_from_feeds(author_id, recipe_id)
+    )
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def reset_follower_feed(sender, instance, **kwargs):
+    invalidate_feed(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    # После удаления первичный ключ экземпляра, то есть key, обнуляется
+    keys = [instance.key]
+    transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+def _tracked_values(user):
+    """Загруженные значения полей, от которых зависит кеш токенов."""
+    values = {}
+    for name in USER_TRACKED_FIELDS:
+        attname = User._meta.get_field(name).attname
+        if attname in user.__dict__:
+            value = user.__dict__[attname]
+            values[attname] = getattr(value, 'name', value)
+    return values
+
+
+@receiver(post_init, sender=User)
+def remember_tracked_fields(sender, instance, **kwargs):
+    instance._tracked_values = _tracked_values(instance)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields, **kwargs):
+    """Сброс кеша токенов при смене пароля, блокировке и т.п.
+
+    Токены запрашиваются, только если изменилось поле из
+    USER_TRACKED_FIELDS: сохранение last_login и счетчиков кеш не
+    затрагивает.
+    """
+    loaded = instance._tracked_values
+    current = _tracked_values(instance)
+    instance._tracked_values = current
+    if created:
+        return
+    changed = {
+        attname for attname, value in current.items()
+        if attname not in loaded or loaded[attname] != value
+    }
+    if update_fields is not None:
+        changed &= {
+            User._meta.get_field(name).attname for name in update_fields
+        }
+    if not changed:
+        return
+    keys = list(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
+    if keys:
+        transaction.on_commit(lambda: invalidate_tokens(keys))
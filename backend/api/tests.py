@@ -0,0 +1,1709 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock, skipIf, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, router
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from api import async_views
+from api.authentication import (
+    CachedTokenAuthentication,
+    _shared_key,
+    invalidate_tokens,
+)
+from api.checks import check_replica_cache, check_shared_cache
+from api.pagination import RecipeCursorPagination
+from api.serializers import MAX_RECIPES_IN_SUBSCRIPTION
+from api.shopping_list import (
+    SHOPPING_LIST_RENDERERS,
+    ShoppingListPDFRenderer,
+)
+from api.uploads import UPLOAD_CHUNK_SIZE
+from identity.models import Subscription
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Tag,
+)
+from recipes.signals import catalog_loaded
+from server.instrumentation import RequestMetrics
+from server.metrics import ARCHIVE_FILE_NAME, archive_process, registry
+from server.postgresql_pool.base import ConnectionPool
+from server.replica import (
+    PRIMARY_DB,
+    REPLICA_DB,
+    ReplicaRoutingMiddleware,
+    _get_client_key,
+)
+
+
+User = get_user_model()
+
+TEST_IMAGE = 'recipes/images/test.png'
+RECIPES_COUNT = 8
+CONCURRENT_REQUESTS = 4
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def create_user(number):
+    return User.objects.create_user(
+        email=f'user{number}@example.com',
+        username=f'user{number}',
+        first_name='Имя',
+        last_name='Фамилия',
+        password='test-password-123',
+    )
+
+
+def create_recipes(author, count, tags, ingredients):
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=f'Рецепт {number}',
+            text='Описание',
+            image=TEST_IMAGE,
+            cooking_time=10,
+        )
+        recipe.tags.set(tags)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=5)
+            for ingredient in ingredients
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+def token_client(user):
+    token, _ = Token.objects.get_or_create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client, token
+
+
+class RecipeQueryCountTest(TestCase):
+    """Число SQL-запросов списка и карточки рецепта не зависит от
+    количества рецептов, тегов и ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.reader = create_user(2)
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}',
+                measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        cls.recipes = create_recipes(
+            cls.author,
+            RECIPES_COUNT,
+            tags,
+            ingredients
+        )
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[-1])
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipes[-2])
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.authorized, token = token_client(self.reader)
+        invalidate_tokens([token.key])
+
+    def test_list_anonymous(self):
+        # COUNT, страница рецептов с авторами, теги, ингредиенты
+        with self.assertNumQueries(4):
+            response = self.anonymous.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'])
+
+    def test_list_authenticated(self):
+        # Токен и те же запросы, флаги считаются в запросе страницы
+        with self.assertNumQueries(5):
+            response = self.authorized.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        flags = {
+            recipe['id']: (
+                recipe['is_favorited'],
+                recipe['is_in_shopping_cart']
+            )
+            for recipe in response.data['results']
+        }
+        self.assertEqual(flags[self.recipes[-1].pk], (True, False))
+        self.assertEqual(flags[self.recipes[-2].pk], (False, True))
+
+    def test_detail_anonymous(self):
+        with self.assertNumQueries(3):
+            response = self.anonymous.get(
+                f'/api/recipes/{self.recipes[0].pk}/'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 4)
+
+    def test_detail_authenticated(self):
+        with self.assertNumQueries(4):
+            response = self.authorized.get(
+                f'/api/recipes/{self.recipes[-1].pk}/'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+
+class SubscriptionRecipesLimitTest(TestCase):
+    """Параметр recipes_limit ограничивает превью рецептов подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user(1)
+        cls.authors = [create_user(number) for number in range(2, 4)]
+        cls.recipe_ids = {}
+        for author, count in zip(cls.authors, (5, 2)):
+            Subscription.objects.create(user=cls.reader, author=author)
+            recipes = create_recipes(author, count, [], [])
+            cls.recipe_ids[author.pk] = [recipe.pk for recipe in recipes]
+
+    def setUp(self):
+        self.client, _ = token_client(self.reader)
+
+    def previews(self, params=None):
+        response = self.client.get('/api/users/subscriptions/', params)
+        self.assertEqual(response.status_code, 200)
+        return {
+            author['id']: (
+                {recipe['id'] for recipe in author['recipes']},
+                author['recipes_count'],
+            )
+            for author in response.data['results']
+        }
+
+    def expected(self, limit):
+        return {
+            author_id: (set(sorted(ids, reverse=True)[:limit]), len(ids))
+            for author_id, ids in self.recipe_ids.items()
+        }
+
+    def test_limit(self):
+        self.assertEqual(self.previews({'recipes_limit': 1}), self.expected(1))
+        self.assertEqual(self.previews({'recipes_limit': 4}), self.expected(4))
+
+    def test_default_and_invalid(self):
+        expected = self.expected(MAX_RECIPES_IN_SUBSCRIPTION)
+        self.assertEqual(self.previews(), expected)
+        self.assertEqual(self.previews({'recipes_limit': 'abc'}), expected)
+        self.assertEqual(
+            self.previews({'recipes_limit': -1}),
+            self.expected(0)
+        )
+
+    def test_subscribe_response(self):
+        author = self.authors[0]
+        Subscription.objects.filter(user=self.reader, author=author).delete()
+        response = self.client.post(
+            f'/api/users/{author.pk}/subscribe/?recipes_limit=2'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            {recipe['id'] for recipe in response.data['recipes']},
+            self.expected(2)[author.pk][0]
+        )
+
+
+class PaginationTest(TestCase):
+    """Постраничная и курсорная пагинация рецептов и подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.reader = create_user(2)
+        ingredient = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+        cls.recipes = create_recipes(
+            cls.author,
+            RECIPES_COUNT,
+            [],
+            [ingredient]
+        )
+        # Одинаковая дата у половины рецептов: курсор различает их
+        # смещением
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in cls.recipes[:4]]
+        ).update(pub_date=cls.recipes[0].pub_date)
+        cls.expected_ids = list(
+            Recipe.objects.order_by('-pub_date', '-id').values_list(
+                'pk',
+                flat=True
+            )
+        )
+        for number in range(3, 6):
+            Subscription.objects.create(
+                user=cls.reader,
+                author=create_user(number)
+            )
+
+    def setUp(self):
+        self.client, _ = token_client(self.reader)
+
+    def collect(self, url):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(len(response.data['results']))
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        return ids, pages
+
+    def test_page_number(self):
+        response = self.client.get('/api/recipes/?page=2')
+        self.assertEqual(response.data['count'], RECIPES_COUNT)
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            self.expected_ids[6:]
+        )
+        self.assertIsNotNone(response.data['previous'])
+        self.assertEqual(
+            self.collect('/api/recipes/'),
+            (self.expected_ids, [6, RECIPES_COUNT - 6])
+        )
+        response = self.client.get('/api/recipes/?page=5')
+        self.assertEqual(response.status_code, 404)
+
+    def test_recipes_cursor(self):
+        ids, pages = self.collect('/api/recipes/?pagination=cursor&limit=3')
+        self.assertEqual(ids, self.expected_ids)
+        self.assertEqual(pages, [3, 3, 2])
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&limit=3'
+        )
+        self.assertNotIn('count', response.data)
+        next_page = self.client.get(response.data['next'])
+        self.assertEqual(
+            [item['id'] for item in next_page.data['results']],
+            self.expected_ids[3:6]
+        )
+        previous_page = self.client.get(next_page.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in previous_page.data['results']],
+            self.expected_ids[:3]
+        )
+
+    @mock.patch.object(RecipeCursorPagination, 'max_page_size', 5)
+    def test_cursor_max_page_size(self):
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&limit=1000'
+        )
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_subscriptions_cursor(self):
+        ids, pages = self.collect(
+            '/api/users/subscriptions/?pagination=cursor&limit=2'
+        )
+        self.assertEqual(
+            ids,
+            sorted(Subscription.objects.values_list('author_id', flat=True))
+        )
+        self.assertEqual(pages, [2, 1])
+
+
+class ReferenceListCacheTest(TestCase):
+    """Списки тегов и ингредиентов отдаются из кеша с ETag и
+    обновляются при смене версии данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        Ingredient.objects.create(name='Мука', measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIn('public', response.headers['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/tags/',
+                headers={'If-None-Match': etag}
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_version_bump_on_save(self):
+        etag = self.client.get('/api/tags/').headers['ETag']
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        response = self.client.get(
+            '/api/tags/',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(
+            [tag['slug'] for tag in response.json()],
+            ['breakfast', 'lunch']
+        )
+
+    def test_version_bump_on_catalog_load(self):
+        etag = self.client.get('/api/ingredients/').headers['ETag']
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Соль', measurement_unit='г')]
+        )
+        # Без сигналов моделей версия не меняется
+        response = self.client.get(
+            '/api/ingredients/',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        catalog_loaded.send(sender=Ingredient)
+        response = self.client.get(
+            '/api/ingredients/',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_query_params_skip_cache(self):
+        response = self.client.get('/api/tags/?page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+
+
+class RecipeSearchTest(TestCase):
+    """Поиск рецептов по названию, описанию и ингредиентам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user(1)
+        cls.in_name, cls.in_text, cls.in_ingredients, cls.other = [
+            Recipe.objects.create(
+                author=author,
+                name=name,
+                text=text,
+                image=TEST_IMAGE,
+                cooking_time=10,
+            )
+            for name, text in (
+                ('Блины с творогом', 'Описание'),
+                ('Сырники', 'Как блины, но из творога'),
+                ('Оладьи', 'Описание'),
+                ('Суп', 'Описание'),
+            )
+        ]
+        RecipeIngredient.objects.create(
+            recipe=cls.in_ingredients,
+            ingredient=Ingredient.objects.create(
+                name='творог',
+                measurement_unit='г'
+            ),
+            amount=200
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.in_ingredients,
+            ingredient=Ingredient.objects.create(
+                name='творог обезжиренный',
+                measurement_unit='г'
+            ),
+            amount=100
+        )
+        Recipe.objects.update_search_vector()
+
+    def search_ids(self, text):
+        response = self.client.get('/api/recipes/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    @skipIf(connection.vendor == 'postgresql', 'Поиск подстроки')
+    def test_substring_fallback(self):
+        self.assertEqual(Recipe.objects.update_search_vector(), 0)
+        self.assertEqual(
+            sorted(self.search_ids('творог')),
+            sorted([self.in_name.pk, self.in_text.pk, self.in_ingredients.pk])
+        )
+        self.assertEqual(self.search_ids('Суп'), [self.other.pk])
+        self.assertEqual(self.search_ids('   '), self.search_ids(''))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Полнотекстовый поиск')
+    def test_ranking(self):
+        self.assertEqual(self.search_ids('творог'), [
+            self.in_name.pk,
+            self.in_ingredients.pk,
+            self.in_text.pk,
+        ])
+        self.assertEqual(
+            self.search_ids('творог -блины'),
+            [self.in_ingredients.pk]
+        )
+
+
+class TokenCacheTest(TestCase):
+    """Кеш токенов хранит только поля пользователя для API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(1)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        invalidate_tokens([self.token.key])
+        self.authentication = CachedTokenAuthentication()
+
+    def authenticate(self):
+        return self.authentication.authenticate_credentials(self.token.key)
+
+    def test_miss_then_hit(self):
+        with self.assertNumQueries(1):
+            user, token = self.authenticate()
+        self.assertEqual(user.pk, self.user.pk)
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_hit_skips_token_query_in_request(self):
+        client, _ = token_client(self.user)
+        client.get('/api/recipes/')
+        # Без рецептов остается только COUNT, запроса токена нет
+        with self.assertNumQueries(1):
+            response = client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_token(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials('unknown')
+
+    def test_token_delete_invalidates(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.get(pk=self.token.pk).delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deactivation_invalidates(self):
+        self.authenticate()
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_user_fields_from_snapshot(self):
+        self.authenticate()
+        User.objects.filter(pk=self.user.pk).update(
+            recipes_count=5,
+            followers_count=7
+        )
+        user, _ = self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertEqual(user.email, self.user.email)
+            self.assertEqual(user.username, self.user.username)
+            self.assertFalse(user.is_staff)
+        # Счетчики не входят в снимок и читаются из базы
+        self.assertEqual(user.recipes_count, 5)
+        self.assertEqual(user.followers_count, 7)
+
+    @override_settings(TOKEN_AUTH_SHARED_CACHE=True)
+    def test_shared_cache_skips_process_memory(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            self.authenticate()
+        # Блокировка в другом воркере: запись в базе и сброс общего кеша
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        cache.delete(_shared_key(self.token.key))
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_save_without_tracked_fields_skips_tokens(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.last_login = timezone.now()
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+        user.recipes_count = 3
+        with self.assertNumQueries(1):
+            user.save()
+        user.set_password('new-password-123')
+        with self.assertNumQueries(2):
+            user.save()
+
+    def test_save_keeps_counters_updated_elsewhere(self):
+        self.authenticate()
+        user, _ = self.authenticate()
+        User.objects.filter(pk=self.user.pk).update(
+            recipes_count=5,
+            followers_count=7,
+            avatar_renditions={'small': 'users/avatars/small.webp'}
+        )
+        user.first_name = 'Новое'
+        user.save()
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.first_name, 'Новое')
+        self.assertEqual(user.recipes_count, 5)
+        self.assertEqual(user.followers_count, 7)
+        self.assertEqual(
+            user.avatar_renditions,
+            {'small': 'users/avatars/small.webp'}
+        )
+
+
+def cart_totals(user):
+    return dict(
+        ShoppingCartTotal.objects.filter(user=user).values_list(
+            'ingredient__name',
+            'amount'
+        )
+    )
+
+
+class ShoppingCartTotalTest(TestCase):
+    """Итоги корзины обновляются при любом изменении корзины."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.buyer = create_user(2)
+        cls.flour = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+        cls.milk = Ingredient.objects.create(
+            name='Молоко',
+            measurement_unit='мл'
+        )
+        cls.first, cls.second = create_recipes(
+            cls.author,
+            2,
+            [],
+            [cls.flour, cls.milk]
+        )
+
+    def setUp(self):
+        self.client, _ = token_client(self.buyer)
+
+    def test_cart_rows_outside_api(self):
+        cart_item = ShoppingCart.objects.create(
+            user=self.buyer,
+            recipe=self.first
+        )
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.second)
+        self.assertEqual(cart_totals(self.buyer), {'Мука': 10, 'Молоко': 10})
+        cart_item.delete()
+        self.assertEqual(cart_totals(self.buyer), {'Мука': 5, 'Молоко': 5})
+
+    def test_recipe_delete_cascade(self):
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.first)
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.second)
+        Recipe.objects.filter(pk=self.first.pk).delete()
+        self.assertEqual(cart_totals(self.buyer), {'Мука': 5, 'Молоко': 5})
+
+    def delete_queries(self, recipe, buyers):
+        for buyer in buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=recipe)
+        with CaptureQueriesContext(connection) as queries:
+            recipe.delete()
+        return len(queries)
+
+    def test_recipe_delete_queries_independent_of_carts(self):
+        buyers = [create_user(number) for number in range(3, 6)]
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.second)
+        self.assertEqual(
+            self.delete_queries(self.first, [self.buyer]),
+            self.delete_queries(self.second, buyers)
+        )
+        for user in [self.buyer] + buyers:
+            self.assertEqual(cart_totals(user), {})
+
+    def test_author_delete_cascade(self):
+        buyers = [create_user(number) for number in range(3, 5)]
+        for buyer in buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=self.first)
+        ShoppingCart.objects.create(user=buyers[0], recipe=self.second)
+        other_recipe = create_recipes(buyers[1], 1, [], [self.flour])[0]
+        ShoppingCart.objects.create(user=buyers[0], recipe=other_recipe)
+        ShoppingCart.objects.create(user=self.author, recipe=other_recipe)
+        User.objects.filter(pk=self.author.pk).delete()
+        self.assertEqual(cart_totals(buyers[0]), {'Мука': 5})
+        self.assertEqual(cart_totals(buyers[1]), {})
+        other_recipe.refresh_from_db()
+        self.assertEqual(other_recipe.in_carts_count, 1)
+
+    def test_amount_edit_single_update(self):
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.first)
+        tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        rows = dict(
+            self.first.recipeingredient_set.values_list('ingredient_id', 'pk')
+        )
+        table = RecipeIngredient._meta.db_table
+        client, _ = token_client(self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(f'/api/recipes/{self.first.pk}/', {
+                'ingredients': [
+                    {'id': self.flour.pk, 'amount': 5},
+                    {'id': self.milk.pk, 'amount': 8},
+                ],
+                'tags': [tag.pk],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        statements = [
+            query['sql'].split()[0]
+            for query in queries.captured_queries
+            if table in query['sql'] and not query['sql'].startswith('SELECT')
+        ]
+        self.assertEqual(statements, ['UPDATE'])
+        self.assertEqual(
+            dict(self.first.recipeingredient_set.values_list(
+                'ingredient_id',
+                'pk'
+            )),
+            rows
+        )
+        self.assertEqual(cart_totals(self.buyer), {'Мука': 5, 'Молоко': 8})
+
+    def test_api_toggles(self):
+        url = f'/api/recipes/{self.first.pk}/shopping_cart/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(cart_totals(self.buyer), {'Мука': 5, 'Молоко': 5})
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(cart_totals(self.buyer), {})
+
+    def test_api_bulk(self):
+        url = '/api/recipes/shopping-cart/bulk/'
+        ids = {'ids': [self.first.pk, self.second.pk]}
+        self.client.post(url, ids, format='json')
+        self.assertEqual(cart_totals(self.buyer), {'Мука': 10, 'Молоко': 10})
+        self.client.delete(url, ids, format='json')
+        self.assertEqual(cart_totals(self.buyer), {})
+
+
+class BulkLinkTest(TestCase):
+    """Пакетные запросы возвращают итог по каждому id и меняют счетчики
+    только для фактически измененных связей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.buyer = create_user(2)
+        cls.flour = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+        cls.first, cls.second = create_recipes(
+            cls.author,
+            2,
+            [],
+            [cls.flour]
+        )
+        cls.missing_id = cls.second.pk + 100
+
+    def setUp(self):
+        self.client, _ = token_client(self.buyer)
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [
+            (result['id'], result['status'])
+            for result in response.data['results']
+        ]
+
+    def in_carts_counts(self):
+        return dict(Recipe.objects.values_list('pk', 'in_carts_count'))
+
+    def test_shopping_cart(self):
+        url = '/api/recipes/shopping-cart/bulk/'
+        # Строка, вставленная в обход блокировки и сигналов
+        ShoppingCart.objects.bulk_create(
+            [ShoppingCart(user=self.buyer, recipe=self.first)]
+        )
+        response = self.client.post(url, {'ids': [
+            self.second.pk,
+            self.first.pk,
+            self.missing_id,
+            self.second.pk,
+        ]}, format='json')
+        self.assertEqual(self.statuses(response), [
+            (self.second.pk, 'created'),
+            (self.first.pk, 'already_exists'),
+            (self.missing_id, 'not_found'),
+        ])
+        self.assertEqual(cart_totals(self.buyer), {'Мука': 5})
+        self.assertEqual(
+            self.in_carts_counts(),
+            {self.first.pk: 0, self.second.pk: 1}
+        )
+        ids = {'ids': [self.second.pk, self.missing_id]}
+        response = self.client.delete(url, ids, format='json')
+        self.assertEqual(self.statuses(response), [
+            (self.second.pk, 'deleted'),
+            (self.missing_id, 'not_found'),
+        ])
+        self.assertEqual(cart_totals(self.buyer), {})
+        self.assertEqual(self.in_carts_counts()[self.second.pk], 0)
+        response = self.client.delete(url, ids, format='json')
+        self.assertEqual(self.statuses(response)[0], (
+            self.second.pk,
+            'not_linked'
+        ))
+        self.assertTrue(
+            ShoppingCart.objects.filter(recipe=self.first).exists()
+        )
+
+    def test_subscriptions(self):
+        url = '/api/users/subscribe/bulk/'
+        ids = {'ids': [self.author.pk, self.buyer.pk]}
+        response = self.client.post(url, ids, format='json')
+        self.assertEqual(self.statuses(response), [
+            (self.author.pk, 'created'),
+            (self.buyer.pk, 'forbidden'),
+        ])
+        response = self.client.post(url, ids, format='json')
+        self.assertEqual(self.statuses(response)[0], (
+            self.author.pk,
+            'already_exists'
+        ))
+        self.author.refresh_from_db(fields=['followers_count'])
+        self.assertEqual(self.author.followers_count, 1)
+        response = self.client.delete(url, ids, format='json')
+        self.assertEqual(self.statuses(response)[0], (
+            self.author.pk,
+            'deleted'
+        ))
+        self.author.refresh_from_db(fields=['followers_count'])
+        self.assertEqual(self.author.followers_count, 0)
+
+
+class ShoppingListStreamingTest(TestCase):
+    """Список покупок отдается потоком и под WSGI, и под ASGI."""
+    url = '/api/recipes/download_shopping_cart/'
+    expected = 'Список покупок:\n\nг:\nМука - 5 г\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = create_user(1)
+        cls.token = Token.objects.create(user=cls.buyer)
+        flour = Ingredient.objects.create(name='Мука', measurement_unit='г')
+        recipe = create_recipes(cls.buyer, 1, [], [flour])[0]
+        ShoppingCart.objects.create(user=cls.buyer, recipe=recipe)
+
+    def setUp(self):
+        invalidate_tokens([self.token.key])
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+
+    def test_wsgi(self):
+        response = self.client.get(self.url, headers=self.headers)
+        self.assertFalse(response.is_async)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            self.expected
+        )
+
+    async def test_asgi(self):
+        response = await self.async_client.get(self.url, headers=self.headers)
+        self.assertTrue(response.is_async)
+        content = b''.join([
+            chunk async for chunk in response.streaming_content
+        ])
+        self.assertEqual(content.decode(), self.expected)
+
+
+class ShoppingListFormatTest(TestCase):
+    """Список покупок выгружается в txt, csv и pdf с группировкой
+    ингредиентов по единицам измерения."""
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = create_user(1)
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (
+                ('Сахар', 'г'),
+                ('Молоко', 'мл'),
+                ('Мука', 'г'),
+            )
+        ]
+        for recipe in create_recipes(cls.buyer, 2, [], ingredients):
+            ShoppingCart.objects.create(user=cls.buyer, recipe=recipe)
+
+    def setUp(self):
+        self.client, _ = token_client(self.buyer)
+
+    def download(self, params=None, **headers):
+        response = self.client.get(self.url, params, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_text_by_default(self):
+        response, content = self.download()
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(content.decode(), (
+            'Список покупок:\n'
+            '\nг:\nМука - 10 г\nСахар - 10 г\n'
+            '\nмл:\nМолоко - 10 мл\n'
+        ))
+
+    def test_csv(self):
+        for params, headers in (
+            ({'format': 'csv'}, {}),
+            (None, {'Accept': 'text/csv'}),
+        ):
+            response, content = self.download(params, **headers)
+            self.assertEqual(
+                response['Content-Type'],
+                'text/csv; charset=utf-8'
+            )
+            self.assertIn('shopping-list.csv', response['Content-Disposition'])
+            self.assertEqual(
+                list(csv.reader(StringIO(content.decode()))),
+                [
+                    ['Единица измерения', 'Ингредиент', 'Количество'],
+                    ['г', 'Мука', '10'],
+                    ['г', 'Сахар', '10'],
+                    ['мл', 'Молоко', '10'],
+                ]
+            )
+
+    @skipIf(
+        ShoppingListPDFRenderer not in SHOPPING_LIST_RENDERERS,
+        'reportlab не установлен'
+    )
+    def test_pdf(self):
+        response, content = self.download({'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('shopping-list.pdf', response['Content-Disposition'])
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncReadViewParityTest(TestCase):
+    """Асинхронные представления чтения отвечают так же, как DRF."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.reader = create_user(2)
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(2)
+        ]
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+        cls.recipes = create_recipes(
+            cls.author,
+            RECIPES_COUNT,
+            cls.tags[:1],
+            [cls.ingredient]
+        )
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[0])
+        cls.token = Token.objects.create(user=cls.reader)
+
+    def setUp(self):
+        invalidate_tokens([self.token.key])
+        self.factory = AsyncRequestFactory()
+
+    def assert_same(self, view, path, headers=None, **kwargs):
+        headers = headers or {}
+        expected = self.client.get(path, headers=headers)
+        response = async_to_sync(view)(
+            self.factory.get(path, headers=headers),
+            **kwargs
+        )
+        if hasattr(response, 'render'):
+            # Ответ запасного пути DRF рендерит обработчик запросов
+            response.render()
+        self.assertEqual(response.status_code, expected.status_code, path)
+        self.assertEqual(
+            json.loads(response.content),
+            json.loads(expected.content),
+            path
+        )
+
+    def check_views(self, headers=None):
+        recipe_id = self.recipes[0].pk
+        other_id = self.recipes[1].pk
+        self.assert_same(async_views.tag_list_view, '/api/tags/', headers)
+        self.assert_same(
+            async_views.ingredient_list_view,
+            '/api/ingredients/',
+            headers
+        )
+        for query in (
+            '',
+            '?page=2',
+            '?page=5',
+            f'?author={self.author.pk}&tags=tag0',
+            '?tags=tag1',
+            '?is_favorited=1',
+        ):
+            self.assert_same(
+                async_views.recipe_list_view,
+                f'/api/recipes/{query}',
+                headers
+            )
+        for pk, query in (
+            (recipe_id, ''),
+            (recipe_id, '?is_favorited=1'),
+            (other_id, '?is_favorited=1'),
+            (other_id, '?tags=tag1'),
+            (other_id + 100, ''),
+        ):
+            self.assert_same(
+                async_views.recipe_detail_view,
+                f'/api/recipes/{pk}/{query}',
+                headers,
+                pk=pk
+            )
+
+    def test_anonymous(self):
+        self.check_views()
+
+    def test_token(self):
+        self.check_views({'Authorization': f'Token {self.token.key}'})
+
+    def test_unknown_token(self):
+        self.assert_same(
+            async_views.recipe_list_view,
+            '/api/recipes/',
+            {'Authorization': 'Token unknown'}
+        )
+
+
+def image_file(size=(4, 4), image_format='PNG', name='image.png'):
+    content = BytesIO()
+    Image.new('RGB', size).save(content, image_format)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadTest(TestCase):
+    """Загрузка изображений файлом с ограничением размера и
+    разрешения."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        ingredient = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+        cls.recipe = create_recipes(cls.author, 1, [], [ingredient])[0]
+        cls.url = f'/api/recipes/{cls.recipe.pk}/image/'
+
+    def setUp(self):
+        self.client, _ = token_client(self.author)
+
+    def upload(self, uploaded_file, url=None, method='post'):
+        return getattr(self.client, method)(
+            url or self.url,
+            {'image': uploaded_file},
+            format='multipart'
+        )
+
+    def test_recipe_image(self):
+        response = self.upload(image_file())
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.png'))
+        self.assertNotIn('image.png', self.recipe.image.name)
+
+    def test_avatar(self):
+        response = self.client.put(
+            '/api/users/me/avatar/',
+            {'avatar': image_file(image_format='JPEG', name='a.jpg')},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.avatar.name.endswith('.jpg'))
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=100)
+    def test_content_length_too_large(self):
+        response = self.upload(
+            SimpleUploadedFile('big.png', b'x' * (UPLOAD_CHUNK_SIZE + 200))
+        )
+        self.assertEqual(response.status_code, 413)
+
+    def test_malformed_content_length(self):
+        response = self.client.post(
+            self.url,
+            {'image': image_file()},
+            format='multipart',
+            CONTENT_LENGTH='abc'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=100)
+    def test_stream_too_large(self):
+        response = self.upload(SimpleUploadedFile('big.png', b'x' * 1000))
+        self.assertEqual(response.status_code, 413)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, TEST_IMAGE)
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=10)
+    def test_pixel_limit(self):
+        response = self.upload(image_file(size=(4, 4)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_not_image(self):
+        response = self.upload(SimpleUploadedFile('a.png', b'not an image'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_unsupported_format(self):
+        response = self.upload(image_file(image_format='BMP', name='a.bmp'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_author(self):
+        client, _ = token_client(create_user(2))
+        response = client.post(
+            self.url,
+            {'image': image_file()},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CounterTest(TestCase):
+    """Счетчики обновляются при изменениях через API и вне его."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.reader = create_user(2)
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+
+    def setUp(self):
+        self.client, _ = token_client(self.reader)
+
+    def assert_counters(self, obj, **expected):
+        obj.refresh_from_db(fields=list(expected))
+        self.assertEqual(
+            {name: getattr(obj, name) for name in expected},
+            expected
+        )
+
+    def test_recipes_count(self):
+        recipe = create_recipes(self.author, 1, [], [self.ingredient])[0]
+        self.assert_counters(self.author, recipes_count=1)
+        response = self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+            'tags': [self.tag.pk],
+            'image': (
+                'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMA'
+                'AABieywaAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxA'
+                'GVKw4bAAAACklEQVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg=='
+            ),
+            'name': 'Блины',
+            'text': 'Описание',
+            'cooking_time': 20,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assert_counters(self.reader, recipes_count=1)
+        recipe.delete()
+        self.assert_counters(self.author, recipes_count=0)
+
+    def test_favorites_count(self):
+        recipe = create_recipes(self.author, 1, [], [self.ingredient])[0]
+        url = f'/api/recipes/{recipe.pk}/favorite/'
+        self.client.post(url)
+        self.assert_counters(recipe, favorites_count=1)
+        self.client.delete(url)
+        self.assert_counters(recipe, favorites_count=0)
+        Favorite.objects.create(user=self.author, recipe=recipe)
+        self.assert_counters(recipe, favorites_count=1)
+        self.author.delete()
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_bulk_favorites_count(self):
+        recipes = create_recipes(self.author, 2, [], [self.ingredient])
+        ids = {'ids': [recipe.pk for recipe in recipes]}
+        self.client.post('/api/recipes/favorite/bulk/', ids, format='json')
+        for recipe in recipes:
+            self.assert_counters(recipe, favorites_count=1)
+        self.client.delete('/api/recipes/favorite/bulk/', ids, format='json')
+        for recipe in recipes:
+            self.assert_counters(recipe, favorites_count=0)
+
+    def test_in_carts_count(self):
+        recipe = create_recipes(self.author, 1, [], [self.ingredient])[0]
+        self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assert_counters(recipe, in_carts_count=1)
+        ShoppingCart.objects.filter(user=self.reader).delete()
+        self.assert_counters(recipe, in_carts_count=0)
+
+    def test_followers_count(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assert_counters(self.author, followers_count=1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assert_counters(self.author, followers_count=0)
+        subscription = Subscription.objects.create(
+            user=self.reader,
+            author=self.author
+        )
+        self.assert_counters(self.author, followers_count=1)
+        self.reader.delete()
+        self.assert_counters(self.author, followers_count=0)
+        self.assertFalse(
+            Subscription.objects.filter(pk=subscription.pk).exists()
+        )
+
+    def save_after(self, model, change):
+        """save() модели, перед которым счетчик меняется в базе."""
+        save = model.save
+
+        def interleaved_save(instance, *args, **kwargs):
+            change()
+            return save(instance, *args, **kwargs)
+
+        return mock.patch.object(model, 'save', interleaved_save)
+
+    def test_recipe_patch_keeps_favorites_count(self):
+        recipe = create_recipes(self.author, 1, [], [self.ingredient])[0]
+        client, token = token_client(self.author)
+        with self.save_after(Recipe, lambda: Favorite.objects.create(
+            user=self.reader,
+            recipe=recipe
+        )):
+            response = client.patch(f'/api/recipes/{recipe.pk}/', {
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 7}],
+                'tags': [self.tag.pk],
+                'name': 'Оладьи',
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_counters(recipe, favorites_count=1)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Оладьи')
+
+    def test_avatar_keeps_followers_count(self):
+        _, token = token_client(self.reader)
+        # Пользователь загружается из базы целиком, а не из снимка
+        invalidate_tokens([token.key])
+        with self.save_after(User, lambda: Subscription.objects.create(
+            user=self.author,
+            author=self.reader
+        )):
+            response = self.client.put('/api/users/me/avatar/', {
+                'avatar': (
+                    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAAB'
+                    'AgMAAABieywaAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA'
+                    '7EAAAOxAGVKw4bAAAACklEQVQImWNoAAAAggCByxOyYQAAAABJRU5E'
+                    'rkJggg=='
+                ),
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_counters(self.reader, followers_count=1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentToggleTest(TransactionTestCase):
+    """Одновременные добавления одной связи создают одну строку и
+    увеличивают счетчик один раз.
+
+    Нужна база с блокировкой строк: тестовая база SQLite в памяти не
+    допускает одновременной записи из нескольких потоков.
+    """
+
+    def setUp(self):
+        self.author = create_user(1)
+        self.reader = create_user(2)
+        self.token = Token.objects.create(user=self.reader)
+        ingredient = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+        self.recipe = create_recipes(self.author, 1, [], [ingredient])[0]
+
+    def post_concurrently(self, url):
+        """Статусы CONCURRENT_REQUESTS одновременных POST-запросов."""
+        barrier = threading.Barrier(CONCURRENT_REQUESTS)
+        statuses = []
+        errors = []
+
+        def post():
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+            try:
+                barrier.wait()
+                statuses.append(client.post(url).status_code)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=post)
+            for _ in range(CONCURRENT_REQUESTS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return sorted(statuses)
+
+    def assert_created_once(self, statuses):
+        self.assertEqual(
+            statuses,
+            [201] + [400] * (CONCURRENT_REQUESTS - 1)
+        )
+
+    def test_favorite(self):
+        statuses = self.post_concurrently(
+            f'/api/recipes/{self.recipe.pk}/favorite/'
+        )
+        self.assert_created_once(statuses)
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_shopping_cart(self):
+        statuses = self.post_concurrently(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        )
+        self.assert_created_once(statuses)
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.assertEqual(
+            list(ShoppingCartTotal.objects.values_list('amount', flat=True)),
+            [5]
+        )
+
+    def test_subscribe(self):
+        statuses = self.post_concurrently(
+            f'/api/users/{self.author.pk}/subscribe/'
+        )
+        self.assert_created_once(statuses)
+        self.assertEqual(Subscription.objects.count(), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class SharedCacheCheckTest(TestCase):
+    """Проверка развертывания требует общий кеш."""
+
+    def test_process_local_cache(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}):
+            warnings = check_shared_cache(None)
+        self.assertEqual([warning.id for warning in warnings], ['api.W001'])
+
+    def test_shared_cache(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://localhost:6379',
+        }}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class InstrumentationTest(TestCase):
+    """Заголовок Server-Timing и отметка повторяющихся запросов N+1."""
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user(1)
+        flour = Ingredient.objects.create(name='Мука', measurement_unit='г')
+        create_recipes(author, 6, [], [flour])
+
+    def request_record(self, level='INFO'):
+        with self.assertLogs('server.instrumentation', level) as logs:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(logs.records[0].getMessage())
+
+    def test_server_timing(self):
+        response, record = self.request_record()
+        self.assertRegex(response['Server-Timing'], (
+            r'^db;dur=[\d.]+;desc="(\d+) queries", '
+            r'serializer;dur=[\d.]+, total;dur=[\d.]+$'
+        ))
+        self.assertIn(
+            f'desc="{record["db_queries"]} queries"',
+            response['Server-Timing']
+        )
+        self.assertEqual(record['view'], 'RecipeViewSet.list')
+
+    @override_settings(INSTRUMENTATION_SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        response, _ = self.request_record()
+        self.assertNotIn('Server-Timing', response)
+
+    def test_list_without_n_plus_one(self):
+        _, record = self.request_record()
+        self.assertNotIn('n_plus_one', record)
+
+    @override_settings(INSTRUMENTATION_N_PLUS_ONE_THRESHOLD=1)
+    def test_n_plus_one_logged_as_warning(self):
+        with self.assertLogs('server.instrumentation', 'WARNING') as logs:
+            self.client.get(self.url)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertTrue(record['n_plus_one'])
+
+    def test_repeated_shapes(self):
+        metrics = RequestMetrics()
+        threshold = settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+        for number in range(threshold):
+            metrics.add_query(
+                f'SELECT * FROM recipe WHERE author_id = {number}',
+                0.001
+            )
+        metrics.add_query('SELECT * FROM tag WHERE id IN (%s, %s)', 0.001)
+        metrics.add_query('SELECT * FROM tag WHERE id IN (%s, %s, %s)', 0.001)
+        self.assertEqual(metrics.repeated_queries(), [{
+            'sql': 'SELECT * FROM recipe WHERE author_id = N',
+            'count': threshold,
+        }])
+        self.assertEqual(
+            metrics.shapes['SELECT * FROM tag WHERE id IN (%s, ...)'],
+            2
+        )
+
+
+class MetricsAccessTest(TestCase):
+    """Метрики закрыты, пока не задан токен или нет прав сотрудника."""
+
+    def test_denied_without_token(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(
+            self.client.get(
+                '/api/metrics',
+                HTTP_AUTHORIZATION='Bearer wrong'
+            ).status_code,
+            403
+        )
+        response = self.client.get(
+            '/api/metrics',
+            HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE http_requests_total counter', response.content)
+
+    def test_staff(self):
+        user = create_user(1)
+        user.is_staff = True
+        user.save()
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/api/metrics').status_code, 200)
+
+
+class MetricsArchiveTest(TestCase):
+    """Значения завершившихся воркеров переносятся в архив."""
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+
+    def write_process(self, pid, favorites, connections):
+        with open(
+            os.path.join(self.metrics_dir, f'{pid}.json'),
+            'w',
+            encoding='utf-8'
+        ) as file:
+            json.dump([
+                [
+                    'foodgram_favorites_added',
+                    'foodgram_favorites_added_total',
+                    [],
+                    favorites
+                ],
+                [
+                    'db_pool_connections',
+                    'db_pool_connections',
+                    [['alias', 'default'], ['state', 'idle']],
+                    connections
+                ],
+            ], file)
+
+    def test_archive_process(self):
+        self.write_process(1001, 2, 5)
+        archive_process(self.metrics_dir, 1001)
+        # Новый процесс с тем же pid начинает с нуля
+        self.write_process(1001, 3, 4)
+        archive_process(self.metrics_dir, 1001)
+        archive_process(self.metrics_dir, 1002)
+        self.assertEqual(os.listdir(self.metrics_dir), [ARCHIVE_FILE_NAME])
+        with open(
+            os.path.join(self.metrics_dir, ARCHIVE_FILE_NAME),
+            encoding='utf-8'
+        ) as file:
+            self.assertEqual(json.load(file), [[
+                'foodgram_favorites_added',
+                'foodgram_favorites_added_total',
+                [],
+                5
+            ]])
+        with override_settings(METRICS_DIR=self.metrics_dir):
+            rows = list(registry._read_files())
+        self.assertEqual(rows, [(
+            (
+                'foodgram_favorites_added',
+                'foodgram_favorites_added_total',
+                ()
+            ),
+            5
+        )])
+
+
+class FakeConnection:
+    closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolCheckTest(SimpleTestCase):
+    """Проверка свободного соединения только после простоя."""
+
+    def setUp(self):
+        self.pool = ConnectionPool('params', max_size=2, timeout=1,
+                                   check_idle=30)
+        self.checked = []
+
+    def check(self, connection):
+        self.checked.append(connection)
+        return True
+
+    def reuse(self, connection):
+        self.pool.release(connection)
+        return self.pool.acquire(FakeConnection, self.check)
+
+    def test_recent_connection_not_checked(self):
+        connection = self.pool.acquire(FakeConnection, self.check)
+        self.assertIs(self.reuse(connection), connection)
+        self.assertEqual(self.checked, [])
+
+    def test_idle_connection_checked(self):
+        connection = self.pool.acquire(FakeConnection, self.check)
+        with mock.patch('time.monotonic', side_effect=[0, 31]):
+            self.assertIs(self.reuse(connection), connection)
+        self.assertEqual(self.checked, [connection])
+
+    def test_failed_check_opens_new_connection(self):
+        connection = self.pool.acquire(FakeConnection, self.check)
+        with mock.patch('time.monotonic', side_effect=[0, 31]):
+            self.pool.release(connection)
+            new_connection = self.pool.acquire(
+                FakeConnection,
+                lambda connection: False
+            )
+        self.assertIsNot(new_connection, connection)
+        self.assertTrue(connection.closed)
+
+
+class FeedTest(TestCase):
+    """Лента подписок видит новые и удаленные рецепты."""
+    url = '/api/recipes/feed/?limit=2'
+
+    def setUp(self):
+        self.author = create_user(1)
+        self.reader = create_user(2)
+        self.ingredient = Ingredient.objects.create(
+            name='Мука',
+            measurement_unit='г'
+        )
+        Subscription.objects.create(user=self.reader, author=self.author)
+        self.client, _ = token_client(self.reader)
+        self.recipes = create_recipes(self.author, 3, [], [self.ingredient])
+        cache.clear()
+
+    def feed_ids(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def check_new_and_deleted_recipes(self):
+        self.assertEqual(
+            self.feed_ids(),
+            [self.recipes[2].pk, self.recipes[1].pk]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            new_recipe = create_recipes(
+                self.author,
+                1,
+                [],
+                [self.ingredient]
+            )[0]
+        self.assertEqual(
+            self.feed_ids(),
+            [new_recipe.pk, self.recipes[2].pk]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            new_recipe.delete()
+        self.assertEqual(
+            self.feed_ids(),
+            [self.recipes[2].pk, self.recipes[1].pk]
+        )
+
+    def test_process_local_cache(self):
+        self.check_new_and_deleted_recipes()
+        self.assertIsNone(cache.get(f'feed:{self.reader.pk}'))
+
+    @mock.patch('api.feed.is_cache_shared', return_value=True)
+    def test_shared_cache(self, is_cache_shared):
+        self.check_new_and_deleted_recipes()
+        self.assertIsNotNone(cache.get(f'feed:{self.reader.pk}'))
+
+    @mock.patch('api.feed.is_cache_shared', return_value=True)
+    def test_deleted_recipe_left_in_feed(self, is_cache_shared):
+        self.feed_ids()
+        key = f'feed:{self.reader.pk}'
+        entries = cache.get(key)
+        # Запись о рецепте, удаленном мимо сигналов
+        stale_id = self.recipes[2].pk + 100
+        cache.set(key, [(entries[0][0] + 1, stale_id)] + entries)
+        self.assertEqual(
+            self.feed_ids(),
+            [self.recipes[2].pk, self.recipes[1].pk]
+        )
+        self.assertNotIn(stale_id, [entry[1] for entry in cache.get(key)])
+
+
+# Отдельная тестовая база для реплики: миграции применяются, а данные
+# основной базы в нее не попадают, как в реплику с отставанием
+connections.settings.setdefault(REPLICA_DB, {
+    **connections[PRIMARY_DB].settings_dict,
+    'NAME': f'{connections[PRIMARY_DB].settings_dict["NAME"]}_replica',
+    'TEST': {
+        **connections[PRIMARY_DB].settings_dict['TEST'],
+        'NAME': None,
+    },
+})
+
+
+@override_settings(
+    DATABASE_ROUTERS=['server.replica.ReplicaRouter'],
+    MIDDLEWARE=settings.MIDDLEWARE + [
+        'server.replica.ReplicaRoutingMiddleware'
+    ],
+)
+class ReplicaRoutingTest(TestCase):
+    """Чтение с реплики, закрепление за основной базой после записи и
+    поиск нового токена в основной базе."""
+    databases = {PRIMARY_DB, REPLICA_DB}
+
+    def setUp(self):
+        self.user = create_user(1)
+        self.factory = RequestFactory()
+        self.key = 'Token replica-test'
+        cache.delete(_get_client_key(
+            self.factory.get('/', HTTP_AUTHORIZATION=self.key)
+        ))
+
+    def read_db(self, method, status=200):
+        """База для чтения внутри запроса через middleware."""
+        used = []
+
+        def get_response(request):
+            used.append(router.db_for_read(Recipe))
+            return HttpResponse(status=status)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        middleware(self.factory.generic(
+            method,
+            '/api/recipes/',
+            HTTP_AUTHORIZATION=self.key
+        ))
+        return used[0]
+
+    def test_outside_request(self):
+        self.assertEqual(router.db_for_read(Recipe), PRIMARY_DB)
+        self.assertEqual(router.db_for_write(Recipe), PRIMARY_DB)
+
+    @mock.patch('server.replica.is_cache_shared', return_value=True)
+    def test_sticky_after_write(self, is_cache_shared):
+        self.assertEqual(self.read_db('GET'), REPLICA_DB)
+        self.assertEqual(self.read_db('POST', status=400), PRIMARY_DB)
+        self.assertEqual(self.read_db('GET'), REPLICA_DB)
+        self.assertEqual(self.read_db('POST', status=201), PRIMARY_DB)
+        self.assertEqual(self.read_db('GET'), PRIMARY_DB)
+
+    def test_process_local_cache(self):
+        self.assertEqual(self.read_db('GET'), PRIMARY_DB)
+        with mock.patch.dict(settings.DATABASES, {REPLICA_DB: {}}):
+            errors = check_replica_cache(None)
+        self.assertEqual([error.id for error in errors], ['api.E001'])
+
+    @mock.patch('server.replica.is_cache_shared', return_value=True)
+    def test_new_token_found_on_primary(self, is_cache_shared):
+        client, token = token_client(self.user)
+        invalidate_tokens([token.key])
+        self.assertFalse(
+            Token.objects.using(REPLICA_DB).filter(pk=token.pk).exists()
+        )
+        response = client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.user.pk)
+        response = APIClient().get(
+            '/api/users/me/',
+            HTTP_AUTHORIZATION='Token unknown'
+        )
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,103 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+
+ALLOWED_IMAGE_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+    'GIF': 'gif',
+}
+MULTIPART_CONTENT_TYPE = 'multipart/form-data'
+UPLOAD_CHUNK_SIZE = 64 * 2 ** 10
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Размер файла превышает допустимый'
+    default_code = 'upload_too_large'
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Запись загружаемого файла во временный файл порциями.
+
+    Загрузка прерывается, как только получено больше max_size байт,
+    поэтому потребление памяти не зависит от размера файла.
+    """
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.too_large = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.too_large = True
+            raise StopUpload()
+        return super().receive_data_chunk(raw_data, start)
+
+
+def is_multipart(request):
+    return request.content_type.startswith(MULTIPART_CONTENT_TYPE)
+
+
+def get_content_length(request):
+    """Длина тела запроса, некорректный заголовок считается отсутствующим.
+
+    Так же заголовок разбирает Django при чтении тела запроса.
+    """
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except (ValueError, TypeError):
+        return 0
+
+
+def get_uploaded_image(request, field_name):
+    """Загруженное изображение из multipart-запроса.
+
+    Размер проверяется до чтения тела запроса и во время записи во
+    временный файл, формат и размер в пикселях - по заголовку
+    изображения без декодирования.
+    """
+    max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+    if get_content_length(request) > max_size + UPLOAD_CHUNK_SIZE:
+        raise UploadTooLarge()
+    handler = LimitedTemporaryFileUploadHandler(request, max_size)
+    request.upload_handlers = [handler]
+    uploaded_file = request.FILES.get(field_name)
+    if handler.too_large:
+        raise UploadTooLarge()
+    if uploaded_file is None:
+        raise serializers.ValidationError(
+            {field_name: 'Файл не передан'}
+        )
+    try:
+        with Image.open(uploaded_file) as image:
+            image_format = image.format
+            width, height = image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise serializers.ValidationError(
+            {field_name: 'Файл не является изображением'}
+        )
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        raise serializers.ValidationError(
+            {field_name: 'Неподдерживаемый формат изображения'}
+        )
+    if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        raise serializers.ValidationError(
+            {field_name: 'Слишком большое разрешение изображения'}
+        )
+    uploaded_file.seek(0)
+    uploaded_file.name = (
+        f'{uuid.uuid4()}.{ALLOWED_IMAGE_FORMATS[image_format]}'
+    )
+    return uploaded_file
@@ -1,10 +1,13 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from api.views import (
     IngredientViewSet,
     RecipeViewSet,
     TagViewSet,
-    CustomUserViewSet
+    CustomUserViewSet,
+    connection_stats,
+    metrics,
 )
 
 
@@ -39,8 +42,41 @@ api_v1_urlpatterns = [
     path('', include(router_v1.urls)),
     path('auth/', include('djoser.urls.authtoken')),
     path('recipes/', include(recipe_urlpatterns)),
+    path('db-connections/', connection_stats, name='db-connections'),
+    path('metrics', metrics, name='metrics'),
 ]
 
+if settings.ASYNC_READ_VIEWS:
+    from api import async_views
+
+    api_v1_urlpatterns = [
+        path(
+            'recipes/',
+            async_views.recipe_list_view,
+            name='recipes-list'
+        ),
+        path(
+            'recipes/<int:pk>/',
+            async_views.recipe_detail_view,
+            name='recipes-detail'
+        ),
+        path(
+            'recipes/<int:pk>/get-link/',
+            async_views.recipe_get_link_view,
+            name='recipes-get-link'
+        ),
+        path(
+            'tags/',
+            async_views.tag_list_view,
+            name='tags-list'
+        ),
+        path(
+            'ingredients/',
+            async_views.ingredient_list_view,
+            name='ingredients-list'
+        ),
+    ] + api_v1_urlpatterns
+
 urlpatterns = [
     path('', include(api_v1_urlpatterns)),
 ]
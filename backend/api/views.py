@@ -1,22 +1,67 @@
+import hmac
+
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
-from django.db.models import Sum
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+)
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
 
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import (
     AllowAny,
+    IsAdminUser,
     IsAuthenticated,
     IsAuthenticatedOrReadOnly
 )
+from rest_framework.exceptions import NotFound, PermissionDenied
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from server.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    favorites_added,
+    registry,
+    shopping_cart_added,
+    subscriptions_created,
+)
 from server.settings import DOMAIN
+from api.bulk import bulk_link, lock_user, shift_counter
+from api.caching import CachedListMixin, get_data_version
+from api.connections import get_connection_stats
+from api.feed import get_feed_page, invalidate_feed
+from api.links import insert_link
+from api.filters import RecipeFilterBackend
+from api.pagination import (
+    MAX_PAGE_SIZE,
+    OptionalCursorPaginationMixin,
+    RecipeCursorPagination,
+    SubscriptionCursorPagination,
+)
+from api.uploads import get_uploaded_image, is_multipart
+from api.shopping_list import (
+    DEFAULT_EXPORT_FORMAT,
+    EXPORT_FORMATS,
+    SHOPPING_LIST_RENDERERS,
+    aiterate,
+    get_shopping_list_rows,
+)
 from identity.models import Subscription
+from recipes.autocomplete import ingredient_index
 from api.serializers import (
+    MAX_RECIPES_IN_SUBSCRIPTION,
+    BulkIdsSerializer,
     CustomUserSerializer,
     SubscriptionSerializer,
     SubscriptionCreateSerializer,
@@ -29,18 +74,20 @@ from recipes.models import (
     Favorite,
     Ingredient,
     Recipe,
-    RecipeIngredient,
     ShoppingCart,
+    ShoppingCartTotal,
     Tag,
 )
 
 User = get_user_model()
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(OptionalCursorPaginationMixin, UserViewSet):
     """Вьюсет для пользователей."""
     queryset = User.objects.all()
     pagination_class = PageNumberPagination
+    cursor_pagination_class = SubscriptionCursorPagination
+    cursor_pagination_actions = ('subscriptions',)
     serializer_class = CustomUserSerializer
 
     def _change_avatar(self, data):
@@ -51,10 +98,33 @@ class CustomUserViewSet(UserViewSet):
         serializer.save()
         return serializer
 
+    def _get_recipes_limit(self):
+        """Лимит рецептов в подписке из параметра recipes_limit."""
+        try:
+            recipes_limit = int(
+                self.request.query_params.get(
+                    'recipes_limit',
+                    MAX_RECIPES_IN_SUBSCRIPTION
+                )
+            )
+        except ValueError:
+            return MAX_RECIPES_IN_SUBSCRIPTION
+        return max(recipes_limit, 0)
+
     def get_queryset(self):
-        queryset = User.objects.all()
+        queryset = User.objects.with_subscription_flag(self.request.user)
         if self.action == 'subscriptions':
-            return queryset.filter(following__user=self.request.user)
+            return queryset.filter(
+                following__user=self.request.user
+            ).prefetch_related(
+                Prefetch(
+                    'recipes',
+                    queryset=Recipe.objects.latest_per_author(
+                        self._get_recipes_limit()
+                    ),
+                    to_attr='preview_recipes',
+                )
+            )
         return queryset
 
     @action(
@@ -71,11 +141,21 @@ class CustomUserViewSet(UserViewSet):
         methods=['put'],
         detail=False,
         permission_classes=[IsAuthenticated],
+        parser_classes=[JSONParser, MultiPartParser],
         url_path='me/avatar',
         url_name='me-avatar',
     )
     def avatar(self, request):
-        """Аватар пользователя"""
+        """Аватар пользователя в Base64 или файлом multipart/form-data"""
+        if is_multipart(request):
+            uploaded_file = get_uploaded_image(request, 'avatar')
+            request.user.avatar.save(
+                uploaded_file.name,
+                uploaded_file,
+                save=False
+            )
+            request.user.save(update_fields=['avatar'])
+            return Response(self.get_serializer(request.user).data)
         serializer = self._change_avatar(request.data)
         return Response(serializer.data)
 
@@ -107,11 +187,18 @@ class CustomUserViewSet(UserViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            subscription = serializer.save()
+            with transaction.atomic():
+                lock_user(user)
+                subscription = serializer.save()
+            subscriptions_created.inc()
+            author.refresh_from_db(fields=['followers_count'])
 
             response_serializer = SubscriptionSerializer(
                 subscription.author,
-                context={'request': request}
+                context={
+                    'request': request,
+                    'recipes_limit': self._get_recipes_limit(),
+                }
             )
             return Response(
                 response_serializer.data,
@@ -119,14 +206,50 @@ class CustomUserViewSet(UserViewSet):
             )
 
         if request.method == 'DELETE':
-            subscription = get_object_or_404(
-                Subscription,
-                user=user,
-                author=author
-            )
-            subscription.delete()
+            with transaction.atomic():
+                lock_user(user)
+                deleted, _ = Subscription.objects.filter(
+                    user=user,
+                    author=author
+                ).delete()
+                if not deleted:
+                    raise NotFound('Вы не подписаны на этого пользователя')
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe/bulk',
+        url_name='subscribe-bulk'
+    )
+    def subscribe_bulk(self, request):
+        """Пакетная подписка на авторов и отписка от них."""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        def change_counters(author_ids, sign):
+            shift_counter(
+                User.objects.filter(pk__in=author_ids),
+                'followers_count',
+                sign
+            )
+            invalidate_feed(request.user.pk)
+            if sign > 0:
+                subscriptions_created.inc(len(author_ids))
+
+        results = bulk_link(
+            request.user,
+            serializer.validated_data['ids'],
+            User.objects.all(),
+            Subscription,
+            'author',
+            request.method == 'POST',
+            change_counters,
+            forbidden_ids={request.user.pk}
+        )
+        return Response({'results': results})
+
     @action(
         detail=False,
         permission_classes=[IsAuthenticated]
@@ -150,31 +273,53 @@ class CustomUserViewSet(UserViewSet):
         return Response(serializer.data)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet для тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    cache_namespace = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet для ингредиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
+    cache_namespace = 'ingredients'
 
     def get_queryset(self):
         queryset = Ingredient.objects.all()
         name = self.request.query_params.get('name')
         if name:
-            queryset = queryset.filter(name__istartswith=name)
+            queryset = queryset.with_name_prefix(name)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        version = get_data_version(self.cache_namespace)
+        ingredients = ingredient_index.search(
+            name,
+            settings.INGREDIENT_SEARCH_LIMIT,
+            version
+        )
+        if ingredients is None:
+            ingredient_index.build_in_background(version)
+            ingredients = self.get_queryset()[
+                :settings.INGREDIENT_SEARCH_LIMIT
+            ]
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(OptionalCursorPaginationMixin, viewsets.ModelViewSet):
     """ViewSet для рецептов."""
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    cursor_pagination_class = RecipeCursorPagination
+    filter_backends = (RecipeFilterBackend,)
     http_method_names = ['get', 'post', 'patch', 'delete']
 
     def get_serializer_class(self):
@@ -183,23 +328,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return RecipeSerializer
 
     def get_queryset(self):
-        queryset = Recipe.objects.all()
-        author = self.request.query_params.get('author')
-        is_favorited = self.request.query_params.get('is_favorited')
-        is_in_shopping_cart = self.request.query_params.get(
-            'is_in_shopping_cart'
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user
         )
-        tags = self.request.query_params.getlist('tags')
-
-        if author:
-            queryset = queryset.filter(author_id=author)
-        if is_favorited and self.request.user.is_authenticated:
-            queryset = queryset.filter(favorites__user=self.request.user)
-        if is_in_shopping_cart and self.request.user.is_authenticated:
-            queryset = queryset.filter(shopping_cart__user=self.request.user)
-        if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
-        return queryset
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -212,19 +343,29 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def favorite(self, request, pk=None):
         recipe = get_object_or_404(Recipe, id=pk)
         if request.method == 'POST':
-            if recipe.favorites.filter(user=request.user).exists():
-                return Response(
-                    {'error': 'Рецепт уже в избранном'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Favorite.objects.create(user=request.user, recipe=recipe)
+            with transaction.atomic():
+                lock_user(request.user)
+                if insert_link(
+                    Favorite,
+                    user=request.user.pk,
+                    recipe=recipe.pk
+                ) is None:
+                    return Response(
+                        {'error': 'Рецепт уже в избранном'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            favorites_added.inc()
             serializer = RecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        favorite = get_object_or_404(Favorite,
-                                     user=request.user,
-                                     recipe=recipe)
-        favorite.delete()
+        with transaction.atomic():
+            lock_user(request.user)
+            deleted, _ = Favorite.objects.filter(
+                user=request.user,
+                recipe=recipe
+            ).delete()
+            if not deleted:
+                raise NotFound('Рецепта нет в избранном')
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -235,50 +376,182 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def shopping_cart(self, request, pk=None):
         recipe = get_object_or_404(Recipe, id=pk)
         if request.method == 'POST':
-            if recipe.shopping_cart.filter(user=request.user).exists():
-                return Response(
-                    {'error': 'Рецепт уже в корзине покупок'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
+            with transaction.atomic():
+                lock_user(request.user)
+                if insert_link(
+                    ShoppingCart,
+                    user=request.user.pk,
+                    recipe=recipe.pk
+                ) is None:
+                    return Response(
+                        {'error': 'Рецепт уже в корзине покупок'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            shopping_cart_added.inc()
             serializer = RecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        shopping_cart = get_object_or_404(ShoppingCart,
-                                          user=request.user,
-                                          recipe=recipe)
-        shopping_cart.delete()
+        with transaction.atomic():
+            lock_user(request.user)
+            deleted, _ = ShoppingCart.objects.filter(
+                user=request.user,
+                recipe=recipe
+            ).delete()
+            if not deleted:
+                raise NotFound('Рецепта нет в корзине покупок')
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _bulk_link(self, request, link_model, on_change):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = bulk_link(
+            request.user,
+            serializer.validated_data['ids'],
+            Recipe.objects.all(),
+            link_model,
+            'recipe',
+            request.method == 'POST',
+            on_change
+        )
+        return Response({'results': results})
+
     @action(
         detail=False,
-        methods=['get'],
-        permission_classes=[IsAuthenticated]
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite/bulk',
+        url_name='favorite-bulk'
     )
-    def download_shopping_cart(self, request):
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        shopping_list = ['Список покупок:\n']
-        for ingredient in ingredients:
-            shopping_list.append(
-                f'{ingredient["ingredient__name"]} - '
-                f'{ingredient["amount"]} '
-                f'{ingredient["ingredient__measurement_unit"]}\n'
+    def favorite_bulk(self, request):
+        """Пакетное добавление рецептов в избранное и удаление из него."""
+        def change_counters(recipe_ids, sign):
+            shift_counter(
+                Recipe.objects.filter(pk__in=recipe_ids),
+                'favorites_count',
+                sign
             )
+            if sign > 0:
+                favorites_added.inc(len(recipe_ids))
+
+        return self._bulk_link(request, Favorite, change_counters)
 
-        response = HttpResponse(''.join(shopping_list),
-                                content_type='text/plain')
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping-cart/bulk',
+        url_name='shopping-cart-bulk'
+    )
+    def shopping_cart_bulk(self, request):
+        """Пакетное добавление рецептов в корзину и удаление из нее."""
+        def change_totals(recipe_ids, sign):
+            ShoppingCartTotal.objects.add_recipes(
+                [request.user.pk],
+                recipe_ids,
+                sign
+            )
+            shift_counter(
+                Recipe.objects.filter(pk__in=recipe_ids),
+                'in_carts_count',
+                sign
+            )
+            if sign > 0:
+                shopping_cart_added.inc(len(recipe_ids))
+
+        return self._bulk_link(request, ShoppingCart, change_totals)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS + [JSONRenderer],
+    )
+    def download_shopping_cart(self, request):
+        """Выгрузка списка покупок в формате txt, csv или pdf."""
+        export_format = request.accepted_renderer.format
+        if export_format not in EXPORT_FORMATS:
+            export_format = DEFAULT_EXPORT_FORMAT
+        render, content_type, filename = EXPORT_FORMATS[export_format]
+
+        content = render(get_shopping_list_rows(request.user))
+        if isinstance(request._request, ASGIRequest):
+            content = aiterate(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
         response['Content-Disposition'] = (
             'attachment; '
-            'filename="shopping-list.txt"'
+            f'filename="{filename}"'
         )
         return response
 
+    @action(
+        detail=True,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        parser_classes=[MultiPartParser],
+    )
+    def image(self, request, pk=None):
+        """Загрузка изображения рецепта файлом multipart/form-data."""
+        recipe = get_object_or_404(Recipe, id=pk)
+        if recipe.author_id != request.user.id:
+            raise PermissionDenied()
+        uploaded_file = get_uploaded_image(request, 'image')
+        recipe.image.save(uploaded_file.name, uploaded_file, save=False)
+        recipe.save(update_fields=['image'])
+        recipe = self.get_queryset().get(pk=recipe.pk)
+        serializer = RecipeSerializer(recipe, context={'request': request})
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated]
+    )
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь."""
+        try:
+            page = int(request.query_params.get('page', 1))
+            limit = int(
+                request.query_params.get('limit', api_settings.PAGE_SIZE)
+            )
+        except ValueError:
+            raise NotFound('Неверная страница')
+        if page < 1 or limit < 1:
+            raise NotFound('Неверная страница')
+        limit = min(limit, MAX_PAGE_SIZE)
+        recipe_ids, has_next = get_feed_page(
+            request.user,
+            (page - 1) * limit,
+            limit
+        )
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        if len(recipes) < len(recipe_ids):
+            # В ленте остались удаленные рецепты, лента строится заново
+            invalidate_feed(request.user.pk)
+            recipe_ids, has_next = get_feed_page(
+                request.user,
+                (page - 1) * limit,
+                limit
+            )
+            recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = RecipeSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context={'request': request}
+        )
+        url = request.build_absolute_uri()
+        previous_url = None
+        if page == 2:
+            previous_url = remove_query_param(url, 'page')
+        elif page > 2:
+            previous_url = replace_query_param(url, 'page', page - 1)
+        return Response({
+            'next': (
+                replace_query_param(url, 'page', page + 1) if has_next
+                else None
+            ),
+            'previous': previous_url,
+            'results': serializer.data,
+        })
+
     @action(
         detail=True,
         methods=['get'],
@@ -290,3 +563,35 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response({
             'short-link': f'https://{DOMAIN}/recipes/{pk}/'
         })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def connection_stats(request):
+    """Состояние соединений с базой данных в текущем воркере."""
+    return Response(get_connection_stats())
+
+
+def has_metrics_access(request):
+    """Доступ по METRICS_TOKEN или для сотрудника с сессией админки."""
+    if request.user.is_staff:
+        return True
+    return bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+        request.headers.get('Authorization', ''),
+        f'Bearer {settings.METRICS_TOKEN}'
+    )
+
+
+def metrics(request):
+    """Метрики всех воркеров в текстовом формате Prometheus.
+
+    Токен METRICS_TOKEN передается в заголовке
+    Authorization: Bearer <токен>. Без заданного токена метрики
+    доступны только сотрудникам.
+    """
+    if not has_metrics_access(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(),
+        content_type=METRICS_CONTENT_TYPE
+    )
@@ -0,0 +1,107 @@
+"""Нагрузочное сравнение режимов WSGI и ASGI.
+
+Запускает одинаковую нагрузку на один или несколько адресов сервера
+и выводит пропускную способность и задержки по каждому пути.
+
+    python benchmarks/serving.py \\
+        --target wsgi=http://localhost:8001 \\
+        --target asgi=http://localhost:8002 \\
+        --concurrency 64 --requests 2000
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?page=2',
+    '/api/tags/',
+    '/api/ingredients/?name=с',
+)
+CONNECTION_ERROR_STATUS = 599
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def fetch(url, headers):
+    started = time.perf_counter()
+    try:
+        with urlopen(Request(url, headers=headers)) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        status = error.code
+    except URLError:
+        status = CONNECTION_ERROR_STATUS
+    return time.perf_counter() - started, status
+
+
+def run(base_url, path, requests, concurrency, headers):
+    url = base_url.rstrip('/') + quote(path, safe='/?=&')
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda _: fetch(url, headers),
+            range(requests)
+        ))
+    elapsed = time.perf_counter() - started
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        'rps': requests / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--target',
+        action='append',
+        required=True,
+        help='Имя и адрес сервера в виде name=url',
+    )
+    parser.add_argument('--path', action='append', dest='paths')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--token', help='Токен для заголовка Authorization')
+    args = parser.parse_args()
+
+    headers = {}
+    if args.token:
+        headers['Authorization'] = f'Token {args.token}'
+    print(
+        f'{"target":<10} {"path":<32} {"rps":>9} {"p50 ms":>9} '
+        f'{"p95 ms":>9} {"p99 ms":>9} {"errors":>7}'
+    )
+    for path in args.paths or DEFAULT_PATHS:
+        for target in args.target:
+            name, base_url = target.split('=', 1)
+            result = run(
+                base_url,
+                path,
+                args.requests,
+                args.concurrency,
+                headers
+            )
+            print(
+                f'{name:<10} {path:<32} {result["rps"]:>9.1f} '
+                f'{result["p50"]:>9.1f} {result["p95"]:>9.1f} '
+                f'{result["p99"]:>9.1f} {result["errors"]:>7}'
+            )
+
+
+if __name__ == '__main__':
+    main()
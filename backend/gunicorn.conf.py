@@ -0,0 +1,38 @@
+import os
+
+import decouple
+
+
+bind = '0.0.0.0:8000'
+
+# Каждый поток воркера держит свое соединение с базой данных,
+# workers * threads не должно превышать max_connections PostgreSQL
+workers = decouple.config('GUNICORN_WORKERS', default=1, cast=int)
+threads = decouple.config('GUNICORN_THREADS', default=1, cast=int)
+
+if decouple.config('SERVER_MODE', default='wsgi') == 'asgi':
+    wsgi_app = 'server.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'server.wsgi:application'
+
+
+def on_starting(server):
+    """Удаление файлов метрик воркеров предыдущего запуска."""
+    metrics_dir = decouple.config('METRICS_DIR', default='')
+    if not metrics_dir:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    for entry in os.scandir(metrics_dir):
+        if entry.name.endswith(('.json', '.json.tmp')):
+            os.remove(entry.path)
+
+
+def child_exit(server, worker):
+    """Перенос метрик завершившегося воркера в архив."""
+    metrics_dir = decouple.config('METRICS_DIR', default='')
+    if not metrics_dir:
+        return
+    from server.metrics import archive_process
+
+    archive_process(metrics_dir, worker.pid)
@@ -1,5 +1,6 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
 
 
 MAX_EMAIL_LENGTH = 254
@@ -7,6 +8,26 @@ MAX_NAME_LENGTH = 150
 AVATAR_UPLOAD_PATH = 'users/avatars/'
 
 
+class UserQuerySet(models.QuerySet):
+    """QuerySet пользователей с подготовкой данных для выдачи в API."""
+
+    def with_subscription_flag(self, user):
+        """Аннотация флага is_subscribed для текущего пользователя."""
+        if user is None or user.is_anonymous:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(
+                Subscription.objects.filter(user=user, author=OuterRef('pk'))
+            )
+        )
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    """Менеджер пользователей с методами UserQuerySet."""
+
+
 class User(AbstractUser):
     """Переопределенная модель пользователя"""
     email = models.EmailField(
@@ -28,6 +49,24 @@ class User(AbstractUser):
         null=True,
         blank=True,
     )
+    avatar_renditions = models.JSONField(
+        'Уменьшенные копии аватара',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    objects = CustomUserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
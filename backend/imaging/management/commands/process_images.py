@@ -0,0 +1,70 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from imaging.queue import get_queue
+from imaging.tasks import process_job
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Обработка очереди изображений: создание уменьшенных копий'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.IMAGE_WORKERS,
+            help='Количество потоков обработки',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать текущую очередь и завершиться',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Пауза между проверками пустой очереди, секунды',
+        )
+
+    def _drain(self, queue):
+        """Обработка задач, пока очередь не опустеет."""
+        processed = 0
+        try:
+            while True:
+                claimed = queue.claim()
+                if claimed is None:
+                    return processed
+                token, job = claimed
+                close_old_connections()
+                try:
+                    process_job(job)
+                    processed += 1
+                except Exception:
+                    logger.exception('Ошибка обработки изображения %s', job)
+                queue.ack(token)
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        workers = options['workers']
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                processed = sum(executor.map(
+                    lambda _: self._drain(queue),
+                    range(workers)
+                ))
+                if processed:
+                    self.stdout.write(f'Обработано изображений: {processed}')
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
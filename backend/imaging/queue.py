@@ -0,0 +1,47 @@
+import json
+import os
+import time
+import uuid
+
+from django.conf import settings
+
+
+class FileSystemQueue:
+    """Очередь задач обработки изображений в каталоге файловой системы.
+
+    Каждая задача хранится отдельным JSON-файлом. Задача забирается
+    атомарным переименованием из pending в processing, поэтому
+    несколько обработчиков не получат одну и ту же задачу.
+    """
+
+    def __init__(self, directory):
+        self.pending = os.path.join(directory, 'pending')
+        self.processing = os.path.join(directory, 'processing')
+        os.makedirs(self.pending, exist_ok=True)
+        os.makedirs(self.processing, exist_ok=True)
+
+    def enqueue(self, job):
+        name = f'{time.time_ns()}-{uuid.uuid4().hex}.json'
+        temporary = os.path.join(self.processing, f'.{name}.tmp')
+        with open(temporary, 'w') as file:
+            json.dump(job, file)
+        os.replace(temporary, os.path.join(self.pending, name))
+
+    def claim(self):
+        """Следующая задача в виде (токен, задача) или None."""
+        for name in sorted(os.listdir(self.pending)):
+            token = os.path.join(self.processing, name)
+            try:
+                os.replace(os.path.join(self.pending, name), token)
+            except FileNotFoundError:
+                continue
+            with open(token) as file:
+                return token, json.load(file)
+        return None
+
+    def ack(self, token):
+        os.remove(token)
+
+
+def get_queue():
+    return FileSystemQueue(settings.IMAGE_QUEUE_DIR)
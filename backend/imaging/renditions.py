@@ -0,0 +1,65 @@
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+
+RENDITION_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+RENDITION_EXTENSIONS = {
+    'WEBP': 'webp',
+    'JPEG': 'jpg',
+}
+
+
+def get_rendition_name(source_name, rendition, extension):
+    """Путь к уменьшенной копии рядом с исходным изображением."""
+    path = PurePosixPath(source_name)
+    filename = f'{path.stem}.{rendition}.{extension}'
+    return str(path.parent / 'renditions' / filename)
+
+
+def _prepare(image, image_format):
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+    if image_format == 'WEBP' and has_alpha:
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def generate_renditions(field_file):
+    """Создание уменьшенных копий изображения во всех размерах.
+
+    Возвращает словарь {название размера: путь в хранилище}.
+    """
+    image_format = settings.IMAGE_RENDITION_FORMAT
+    extension = RENDITION_EXTENSIONS[image_format]
+    storage = field_file.storage
+    renditions = {}
+    with field_file.open('rb') as source, Image.open(source) as image:
+        image = _prepare(image, image_format)
+        for rendition, size in RENDITION_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(
+                buffer,
+                image_format,
+                quality=settings.IMAGE_RENDITION_QUALITY,
+                optimize=True,
+            )
+            name = get_rendition_name(field_file.name, rendition, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            renditions[rendition] = storage.save(
+                name,
+                ContentFile(buffer.getvalue())
+            )
+    return renditions
@@ -0,0 +1,21 @@
+from django.apps import apps
+from django.db.models.signals import post_save
+
+from imaging.tasks import IMAGE_FIELDS, needs_renditions, schedule_renditions
+
+
+def schedule_image_renditions(sender, instance, raw=False, **kwargs):
+    """Постановка в очередь создания копий нового изображения."""
+    if raw:
+        return
+    field, renditions_field = IMAGE_FIELDS[sender._meta.label_lower]
+    if needs_renditions(instance, field, renditions_field):
+        schedule_renditions(instance)
+
+
+for label in IMAGE_FIELDS:
+    post_save.connect(
+        schedule_image_renditions,
+        sender=apps.get_model(label),
+        dispatch_uid=f'schedule_image_renditions_{label}',
+    )
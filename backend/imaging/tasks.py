@@ -0,0 +1,51 @@
+from django.apps import apps
+from django.db import transaction
+
+from imaging.queue import get_queue
+from imaging.renditions import generate_renditions
+
+
+IMAGE_FIELDS = {
+    'recipes.recipe': ('image', 'image_renditions'),
+    'identity.user': ('avatar', 'avatar_renditions'),
+}
+
+
+def needs_renditions(instance, field, renditions_field):
+    """Изменилось ли изображение с момента создания копий."""
+    source = getattr(instance, field).name or None
+    return source != getattr(instance, renditions_field).get('source')
+
+
+def schedule_renditions(instance):
+    """Постановка задачи на создание копий после фиксации транзакции."""
+    job = {
+        'model': instance._meta.label_lower,
+        'pk': instance.pk,
+    }
+    transaction.on_commit(lambda: get_queue().enqueue(job))
+
+
+def process_job(job):
+    """Создание копий изображения для объекта из задачи."""
+    model = apps.get_model(job['model'])
+    field, renditions_field = IMAGE_FIELDS[job['model']]
+    instance = model.objects.filter(pk=job['pk']).only(
+        field,
+        renditions_field
+    ).first()
+    if instance is None:
+        return
+    if not needs_renditions(instance, field, renditions_field):
+        return
+    field_file = getattr(instance, field)
+    renditions = {}
+    if field_file:
+        renditions = {
+            'source': field_file.name,
+            **generate_renditions(field_file),
+        }
+    model.objects.filter(
+        pk=instance.pk,
+        **{field: field_file.name}
+    ).update(**{renditions_field: renditions})
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Sum
 
 from recipes.models import (
     Favorite,
@@ -6,6 +7,7 @@ from recipes.models import (
     Recipe,
     RecipeIngredient,
     ShoppingCart,
+    ShoppingCartTotal,
     Tag,
 )
 
@@ -32,14 +34,38 @@ class RecipeIngredientInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorites_count')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
     search_fields = ('name', 'author__username', 'author__email')
     list_filter = ('tags', 'author')
+    list_select_related = ('author',)
     inlines = (RecipeIngredientInline,)
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
-    favorites_count.short_description = 'В избранном'
+    def _ingredient_amounts(self, recipe):
+        return dict(
+            RecipeIngredient.objects.filter(recipe=recipe).values(
+                'ingredient_id'
+            ).annotate(total=Sum('amount')).values_list(
+                'ingredient_id',
+                'total'
+            ).order_by()
+        )
+
+    def save_related(self, request, form, formsets, change):
+        """Сохранение ингредиентов с пересчетом итогов корзин."""
+        recipe = form.instance
+        before = self._ingredient_amounts(recipe) if change else {}
+        super().save_related(request, form, formsets, change)
+        if not change:
+            return
+        after = self._ingredient_amounts(recipe)
+        ShoppingCartTotal.objects.apply_deltas(
+            recipe.shopping_cart.values_list('user_id', flat=True),
+            {
+                ingredient_id: after.get(ingredient_id, 0)
+                - before.get(ingredient_id, 0)
+                for ingredient_id in before.keys() | after.keys()
+            }
+        )
 
 
 @admin.register(Favorite)
@@ -54,3 +80,10 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
     list_filter = ('user', 'recipe')
+
+
+@admin.register(ShoppingCartTotal)
+class ShoppingCartTotalAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    search_fields = ('user__username', 'ingredient__name')
+    list_select_related = ('user', 'ingredient')
@@ -0,0 +1,118 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для поиска по префиксу.
+
+    Хранит отсортированный список пар (название в нижнем регистре,
+    ингредиент), поэтому поиск по префиксу сводится к бинарному поиску
+    и срезу без обращения к базе данных. Индекс помечается версией
+    данных справочника, что позволяет заметить изменения, сделанные
+    другими процессами через общий кеш. Версия в кеше памяти процесса
+    не видна другим воркерам и командам загрузки справочника, поэтому
+    индекс также устаревает через INGREDIENT_INDEX_TTL секунд после
+    построения.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._building = False
+        self._keys = None
+        self._ingredients = None
+        self._version = None
+        self._built = None
+
+    @property
+    def is_ready(self):
+        return self._keys is not None
+
+    def build(self, version=None):
+        """Загрузка всех ингредиентов и построение индекса.
+
+        version - версия данных, полученная до чтения ингредиентов.
+        """
+        from recipes.models import Ingredient
+
+        generation = self._generation
+        entries = sorted(
+            (
+                (ingredient.name.lower(), ingredient.name, ingredient.pk),
+                ingredient,
+            )
+            for ingredient in Ingredient.objects.all()
+        )
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._keys = [key[0] for key, _ in entries]
+            self._ingredients = [ingredient for _, ingredient in entries]
+            self._version = version
+            self._built = time.monotonic()
+
+    def build_in_background(self, version=None):
+        """Построение индекса в фоновом потоке."""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(
+            target=self._safe_build,
+            args=(version,),
+            daemon=True
+        ).start()
+
+    def _safe_build(self, version):
+        try:
+            self.build(version)
+        except DatabaseError:
+            pass
+        finally:
+            connection.close()
+            self._building = False
+
+    def invalidate(self):
+        """Сброс индекса, следующий поиск уйдет в базу данных."""
+        with self._lock:
+            self._generation += 1
+            self._keys = None
+            self._ingredients = None
+            self._version = None
+            self._built = None
+
+    def is_expired(self):
+        built = self._built
+        return (
+            built is None
+            or time.monotonic() - built >= settings.INGREDIENT_INDEX_TTL
+        )
+
+    def search(self, prefix, limit=None, version=None):
+        """Ингредиенты, название которых начинается с prefix.
+
+        Возвращает None, если индекс еще не построен, устарел или
+        построен для другой версии данных.
+        """
+        keys, ingredients = self._keys, self._ingredients
+        if keys is None or ingredients is None or self.is_expired():
+            return None
+        if version is not None and version != self._version:
+            return None
+        prefix = prefix.lower()
+        start = bisect_left(keys, prefix)
+        result = []
+        for position in range(start, len(keys)):
+            if not keys[position].startswith(prefix):
+                break
+            if limit is not None and len(result) >= limit:
+                break
+            result.append(ingredients[position])
+        return result
+
+
+ingredient_index = IngredientIndex()
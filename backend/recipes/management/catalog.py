@@ -0,0 +1,229 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from api.caching import is_cache_shared
+from recipes.signals import catalog_loaded
+
+
+BATCH_SIZE = 5000
+
+
+def read_rows(path, fields):
+    """Построчное чтение записей справочника из файла.
+
+    Поддерживаются CSV со столбцами в порядке fields (строка заголовка
+    пропускается), JSON Lines и JSON-массив объектов. CSV и JSON Lines
+    читаются потоково, JSON-массив загружается целиком.
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        with open(path, encoding='utf-8', newline='') as file:
+            if suffix == '.csv':
+                for row in csv.reader(file):
+                    values = [value.strip() for value in row]
+                    if not any(values):
+                        continue
+                    if [value.lower() for value in values] == list(fields):
+                        continue
+                    yield dict(zip(fields, values))
+            elif suffix in ('.jsonl', '.ndjson'):
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+            elif suffix == '.json':
+                yield from json.load(file)
+            else:
+                raise CommandError(f'Неподдерживаемый формат файла: {path}')
+    except OSError as error:
+        raise CommandError(f'Не удалось прочитать файл {path}: {error}')
+    except (ValueError, csv.Error) as error:
+        raise CommandError(f'Ошибка разбора файла {path}: {error}')
+
+
+class CatalogLoadCommand(BaseCommand):
+    """Пакетная загрузка справочника из файла.
+
+    Записи вставляются пачками через bulk_create с разрешением
+    конфликтов по уникальным полям, поэтому повторная загрузка того же
+    файла не создает дубликатов. Если у модели несколько отдельно
+    уникальных полей, они перечисляются в match_fields: запись файла
+    обновляет существующую, совпавшую с ней по любому из них.
+
+    Воркеры узнают об изменении справочника через общий кеш, поэтому
+    с кешем в памяти процесса команда завершается ошибкой, если не
+    указан --allow-local-cache.
+    """
+    model = None
+    fields = ()
+    unique_fields = ()
+    update_fields = ()
+    match_fields = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Путь к файлу .csv, .json или .jsonl',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество записей в одном INSERT',
+        )
+        parser.add_argument(
+            '--allow-local-cache',
+            action='store_true',
+            help=(
+                'Загрузить справочник при кеше в памяти процесса, '
+                'например до запуска воркеров'
+            ),
+        )
+
+    def _make_batches(self, rows, batch_size):
+        batch = {}
+        for number, row in enumerate(rows, 1):
+            try:
+                values = {field: row[field] for field in self.fields}
+            except (KeyError, TypeError):
+                raise CommandError(
+                    f'Запись {number}: ожидаются поля '
+                    f'{", ".join(self.fields)}'
+                )
+            key = tuple(values[field] for field in self.unique_fields)
+            batch[key] = self.model(**values)
+            if len(batch) >= batch_size:
+                yield list(batch.values())
+                batch = {}
+        if batch:
+            yield list(batch.values())
+
+    def _find_existing(self, objects):
+        """Существующая запись для каждого объекта или None.
+
+        Сначала запись ищется по unique_fields, затем по остальным
+        match_fields, например при смене слага.
+        """
+        condition = Q()
+        for field in self.match_fields:
+            condition |= Q(**{
+                f'{field}__in': [getattr(obj, field) for obj in objects]
+            })
+        rows = list(
+            self.model.objects.select_for_update().filter(condition)
+        )
+        found = {
+            field: {getattr(row, field): row for row in rows}
+            for field in self.match_fields
+        }
+        key_fields = [
+            field for field in self.match_fields
+            if field in self.unique_fields
+        ]
+        other_fields = [
+            field for field in self.match_fields
+            if field not in self.unique_fields
+        ]
+        matches, claimed = [], set()
+        for obj in objects:
+            matches.append(next((
+                found[field][getattr(obj, field)]
+                for field in key_fields
+                if getattr(obj, field) in found[field]
+            ), None))
+            if matches[-1] is not None:
+                claimed.add(matches[-1].pk)
+        for number, obj in enumerate(objects):
+            if matches[number] is not None:
+                continue
+            candidates = {
+                found[field][getattr(obj, field)].pk: (
+                    found[field][getattr(obj, field)]
+                )
+                for field in other_fields
+                if getattr(obj, field) in found[field]
+            }
+            if len(candidates) == 1:
+                row = next(iter(candidates.values()))
+                if row.pk not in claimed:
+                    matches[number] = row
+                    claimed.add(row.pk)
+        return matches
+
+    def _save_matched(self, objects):
+        """Обновление совпавших записей и вставка новых.
+
+        Совпавшие записи сначала получают временные уникальные значения
+        match_fields, поэтому обмен названиями или цветами между
+        записями не нарушает уникальность посреди обновления.
+        """
+        with transaction.atomic():
+            to_update, to_create = [], []
+            for obj, row in zip(objects, self._find_existing(objects)):
+                if row is None:
+                    to_create.append(obj)
+                    continue
+                obj.pk = row.pk
+                to_update.append(obj)
+            if to_update:
+                self.model.objects.bulk_update(
+                    [
+                        self.model(pk=obj.pk, **{
+                            field: f'~{obj.pk}'
+                            for field in self.match_fields
+                        })
+                        for obj in to_update
+                    ],
+                    self.match_fields
+                )
+                self.model.objects.bulk_update(to_update, self.fields)
+            if to_create:
+                self.model.objects.bulk_create(to_create)
+
+    def _save_batch(self, objects):
+        if self.match_fields:
+            self._save_matched(objects)
+        elif self.update_fields:
+            self.model.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=self.unique_fields,
+                update_fields=self.update_fields,
+            )
+        else:
+            self.model.objects.bulk_create(objects, ignore_conflicts=True)
+
+    def handle(self, *args, **options):
+        if not is_cache_shared() and not options['allow_local_cache']:
+            raise CommandError(
+                'Кеш хранится в памяти процесса: запущенные воркеры не '
+                'увидят изменения справочника до истечения '
+                'REFERENCE_CACHE_TIMEOUT и INGREDIENT_INDEX_TTL. Задайте '
+                'общий CACHE_BACKEND или укажите --allow-local-cache.'
+            )
+        started = time.perf_counter()
+        loaded = 0
+        try:
+            for batch in self._make_batches(
+                read_rows(options['path'], self.fields),
+                options['batch_size']
+            ):
+                self._save_batch(batch)
+                loaded += len(batch)
+        except IntegrityError as error:
+            raise CommandError(
+                f'Ошибка записи после {loaded} записей: {error}'
+            )
+        finally:
+            if loaded:
+                catalog_loaded.send(sender=self.model)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано записей: {loaded} за {elapsed:.2f} с '
+            f'({loaded / max(elapsed, 1e-9):.0f} записей/с)'
+        ))
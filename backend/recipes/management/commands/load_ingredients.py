@@ -0,0 +1,9 @@
+from recipes.management.catalog import CatalogLoadCommand
+from recipes.models import Ingredient
+
+
+class Command(CatalogLoadCommand):
+    help = 'Загрузка ингредиентов из CSV или JSON'
+    model = Ingredient
+    fields = ('name', 'measurement_unit')
+    unique_fields = ('name', 'measurement_unit')
@@ -0,0 +1,10 @@
+from recipes.management.catalog import CatalogLoadCommand
+from recipes.models import Tag
+
+
+class Command(CatalogLoadCommand):
+    help = 'Загрузка тегов из CSV или JSON'
+    model = Tag
+    fields = ('name', 'color', 'slug')
+    unique_fields = ('slug',)
+    match_fields = ('slug', 'name', 'color')
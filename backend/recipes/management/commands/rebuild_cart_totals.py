@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingCartTotal
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Пересчет и проверка итогов корзин покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сравнить итоги с корзинами, не пересчитывая',
+        )
+
+    def _live_totals(self):
+        """Суммы ингредиентов, посчитанные по корзинам покупок."""
+        return RecipeIngredient.objects.filter(
+            recipe__shopping_cart__isnull=False
+        ).values_list(
+            'recipe__shopping_cart__user',
+            'ingredient'
+        ).annotate(
+            total=Sum('amount')
+        ).order_by()
+
+    def _find_mismatches(self):
+        live = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in self._live_totals().iterator(chunk_size=BATCH_SIZE)
+        }
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingCartTotal.objects.values_list(
+                'user_id',
+                'ingredient_id',
+                'amount'
+            ).iterator(chunk_size=BATCH_SIZE)
+        }
+        return [
+            key for key in live.keys() | stored.keys()
+            if live.get(key) != stored.get(key)
+        ]
+
+    @transaction.atomic
+    def _rebuild(self):
+        ShoppingCartTotal.objects.all().delete()
+        batch = []
+        created = 0
+        for user_id, ingredient_id, amount in self._live_totals().iterator(
+            chunk_size=BATCH_SIZE
+        ):
+            batch.append(ShoppingCartTotal(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                amount=amount,
+            ))
+            if len(batch) >= BATCH_SIZE:
+                ShoppingCartTotal.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        ShoppingCartTotal.objects.bulk_create(batch)
+        return created + len(batch)
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            created = self._rebuild()
+            self.stdout.write(f'Пересчитано строк итогов: {created}')
+        mismatches = self._find_mismatches()
+        if mismatches:
+            raise CommandError(
+                f'Расхождений итогов с корзинами: {len(mismatches)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Итоги совпадают с корзинами'))
@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from identity.models import Subscription
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+
+User = get_user_model()
+
+
+def count_subquery(queryset, field):
+    """Подзапрос количества строк queryset для OuterRef('pk')."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(count=Count('pk')).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite.objects.all(), 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart.objects.all(), 'recipe'),
+    (User, 'recipes_count', Recipe.objects.all(), 'author'),
+    (User, 'followers_count', Subscription.objects.all(), 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Сверка и исправление счетчиков рецептов и пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только показать расхождения, не исправляя их',
+        )
+
+    def handle(self, *args, **options):
+        for model, field, queryset, related_field in COUNTERS:
+            actual = count_subquery(queryset, related_field)
+            drifted = model.objects.alias(actual=actual).exclude(
+                **{field: F('actual')}
+            )
+            if options['check']:
+                fixed = drifted.count()
+            else:
+                fixed = drifted.update(**{field: actual})
+            self.stdout.write(
+                f'{model._meta.model_name}.{field}: расхождений {fixed}'
+            )
@@ -0,0 +1,271 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from identity.models import Subscription
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Tag,
+)
+from recipes.signals import catalog_loaded
+
+
+User = get_user_model()
+
+BENCHMARK_PREFIX = 'bench_'
+BENCHMARK_EMAIL_DOMAIN = 'benchmark.local'
+BENCHMARK_PASSWORD = 'benchmark-password'
+BENCHMARK_IMAGE = 'recipes/images/benchmark.png'
+BATCH_SIZE = 5000
+ZIPF_EXPONENT = 1.1
+BENCHMARK_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+MEASUREMENT_UNITS = ('г', 'мл', 'шт', 'ст. л.', 'ч. л.')
+
+
+class ZipfChooser:
+    """Выбор элементов с распределением Ципфа.
+
+    Первые элементы выбираются значительно чаще остальных, что
+    моделирует популярных авторов, рецепты и ингредиенты.
+    """
+
+    def __init__(self, rng, population, exponent=ZIPF_EXPONENT):
+        self.rng = rng
+        self.population = list(population)
+        self.rng.shuffle(self.population)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent
+            for rank in range(1, len(self.population) + 1)
+        ))
+
+    def choose(self, count):
+        return self.rng.choices(
+            self.population,
+            cum_weights=self.cum_weights,
+            k=count
+        )
+
+
+class Command(BaseCommand):
+    help = 'Генерация синтетических данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients-per-recipe',
+            type=int,
+            default=8,
+            help='Среднее количество ингредиентов в рецепте',
+        )
+        parser.add_argument(
+            '--catalog-size',
+            type=int,
+            default=2000,
+            help='Размер справочника ингредиентов, если он пуст',
+        )
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--carts', type=int, default=5000)
+        parser.add_argument('--subscriptions', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Удалить ранее сгенерированные данные перед генерацией',
+        )
+
+    def _log(self, message):
+        self.stdout.write(message)
+
+    def _benchmark_users(self):
+        return User.objects.filter(username__startswith=BENCHMARK_PREFIX)
+
+    def _ensure_catalog(self, catalog_size):
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in BENCHMARK_TAGS
+            )
+            catalog_loaded.send(sender=Tag)
+        if not Ingredient.objects.exists():
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(
+                        name=f'ингредиент {number}',
+                        measurement_unit=MEASUREMENT_UNITS[
+                            number % len(MEASUREMENT_UNITS)
+                        ],
+                    )
+                    for number in range(catalog_size)
+                ),
+                batch_size=self.batch_size
+            )
+            catalog_loaded.send(sender=Ingredient)
+
+    def _create_users(self, count):
+        password = make_password(BENCHMARK_PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'{BENCHMARK_PREFIX}{number}',
+                    email=(
+                        f'{BENCHMARK_PREFIX}{number}@{BENCHMARK_EMAIL_DOMAIN}'
+                    ),
+                    first_name='Пользователь',
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size
+        )
+        return list(self._benchmark_users().values_list('pk', flat=True))
+
+    def _create_recipes(self, count, authors):
+        now = timezone.now()
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=author_id,
+                    name=f'Рецепт {number}',
+                    text=f'Описание рецепта {number}',
+                    image=BENCHMARK_IMAGE,
+                    cooking_time=self.rng.randint(5, 180),
+                )
+                for number, author_id in enumerate(authors.choose(count))
+            ),
+            batch_size=self.batch_size
+        )
+        for recipe in recipes:
+            recipe.pub_date = now - timedelta(
+                minutes=self.rng.randint(0, 365 * 24 * 60)
+            )
+        Recipe.objects.bulk_update(
+            recipes,
+            ['pub_date'],
+            batch_size=self.batch_size
+        )
+        return [recipe.pk for recipe in recipes]
+
+    def _create_recipe_links(self, recipe_ids, per_recipe):
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        ingredients = ZipfChooser(
+            self.rng,
+            Ingredient.objects.values_list('pk', flat=True)
+        )
+        TagLink = Recipe.tags.through
+        tag_links, recipe_ingredients = [], []
+        for recipe_id in recipe_ids:
+            for tag_id in self.rng.sample(
+                tag_ids,
+                self.rng.randint(1, len(tag_ids))
+            ):
+                tag_links.append(TagLink(recipe_id=recipe_id, tag_id=tag_id))
+            size = max(1, int(self.rng.gauss(per_recipe, per_recipe / 3)))
+            for ingredient_id in set(ingredients.choose(size)):
+                recipe_ingredients.append(RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.rng.randint(1, 500),
+                ))
+        TagLink.objects.bulk_create(tag_links, batch_size=self.batch_size)
+        RecipeIngredient.objects.bulk_create(
+            recipe_ingredients,
+            batch_size=self.batch_size
+        )
+        return len(recipe_ingredients)
+
+    def _create_pairs(self, model, target_field, count, users, targets,
+                      exclude_self=False):
+        """Связи пользователей с объектами, смещенные к популярным."""
+        pairs = set()
+        attempts = 0
+        while len(pairs) < count and attempts < 10:
+            needed = count - len(pairs)
+            pairs.update(
+                (user_id, target_id)
+                for user_id, target_id in zip(
+                    users.choose(needed),
+                    targets.choose(needed)
+                )
+                if not (exclude_self and user_id == target_id)
+            )
+            attempts += 1
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, **{f'{target_field}_id': target_id})
+                for user_id, target_id in pairs
+            ),
+            batch_size=self.batch_size,
+            ignore_conflicts=True
+        )
+        return len(pairs)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if options['clear']:
+            self._benchmark_users().delete()
+        elif self._benchmark_users().exists():
+            raise CommandError(
+                'Данные для тестирования уже созданы, '
+                'используйте --clear для пересоздания'
+            )
+        with transaction.atomic():
+            self._ensure_catalog(options['catalog_size'])
+            user_ids = self._create_users(options['users'])
+            self._log(f'Пользователей: {len(user_ids)}')
+            authors = ZipfChooser(self.rng, user_ids)
+            recipe_ids = self._create_recipes(options['recipes'], authors)
+            self._log(f'Рецептов: {len(recipe_ids)}')
+            self._log('Ингредиентов в рецептах: {}'.format(
+                self._create_recipe_links(
+                    recipe_ids,
+                    options['ingredients_per_recipe']
+                )
+            ))
+            users = ZipfChooser(self.rng, user_ids, exponent=0.5)
+            recipes = ZipfChooser(self.rng, recipe_ids)
+            for model, option in (
+                (Favorite, 'favorites'),
+                (ShoppingCart, 'carts'),
+            ):
+                created = self._create_pairs(
+                    model,
+                    'recipe',
+                    options[option],
+                    users,
+                    recipes
+                )
+                self._log(f'{model._meta.verbose_name_plural}: {created}')
+            created = self._create_pairs(
+                Subscription,
+                'author',
+                options['subscriptions'],
+                users,
+                authors,
+                exclude_self=True
+            )
+            self._log(f'Подписок: {created}')
+        for command in (
+            'reconcile_counters',
+            'rebuild_cart_totals',
+            'update_search_vectors',
+        ):
+            call_command(command, stdout=self.stdout)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from recipes.models import Recipe
+
+
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = 'Пересчет поисковых векторов рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество рецептов в одном UPDATE',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = Recipe.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+        updated = 0
+        for start in range(0, last_pk, batch_size):
+            updated += Recipe.objects.filter(
+                pk__gt=start,
+                pk__lte=start + batch_size,
+            ).update_search_vector()
+        self.stdout.write(
+            self.style.SUCCESS(f'Обновлено поисковых векторов: {updated}')
+        )
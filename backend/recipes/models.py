@@ -1,10 +1,35 @@
+from collections import defaultdict
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (
+    BooleanField,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    Window,
+)
+from django.db.models.functions import Lower, RowNumber
 
 
 User = get_user_model()
 
+SEARCH_CONFIG = 'russian'
+
 
 class Tag(models.Model):
     """Модель для тегов рецептов."""
@@ -33,6 +58,44 @@ class Tag(models.Model):
         return self.name
 
 
+class PatternOpsIndex(models.Index):
+    """Индекс по выражениям с классами операторов PostgreSQL.
+
+    Классы операторов есть только в PostgreSQL, на других базах, например
+    SQLite, индекс создается по тем же выражениям без них.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        index = self
+        if schema_editor.connection.vendor != 'postgresql':
+            index = self.clone()
+            index.expressions = tuple(
+                expression.get_source_expressions()[0]
+                if isinstance(expression, OpClass) else expression
+                for expression in self.expressions
+            )
+        return super(PatternOpsIndex, index).create_sql(
+            model,
+            schema_editor,
+            using=using,
+            **kwargs
+        )
+
+
+class IngredientQuerySet(models.QuerySet):
+    """QuerySet ингредиентов."""
+
+    def with_name_prefix(self, prefix):
+        """Ингредиенты, название которых начинается с prefix.
+
+        Условие LOWER(name) LIKE 'prefix%' использует индекс
+        ingredient_lower_name_idx.
+        """
+        return self.alias(lower_name=Lower('name')).filter(
+            lower_name__startswith=prefix.lower()
+        )
+
+
 class Ingredient(models.Model):
     """Модель для ингредиентов."""
     name = models.CharField(
@@ -44,6 +107,8 @@ class Ingredient(models.Model):
         max_length=200,
     )
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
@@ -54,11 +119,115 @@ class Ingredient(models.Model):
                 name='unique_ingredient'
             )
         ]
+        indexes = [
+            PatternOpsIndex(
+                OpClass(Lower('name'), name='text_pattern_ops'),
+                name='ingredient_lower_name_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов с подготовкой данных для выдачи в API."""
+
+    def with_related(self):
+        """Подгрузка автора, тегов и ингредиентов пакетными запросами."""
+        return self.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        )
+
+    def latest_per_author(self, limit):
+        """Не более limit последних рецептов каждого автора.
+
+        Нумерация строк оконной функцией позволяет получить превью
+        рецептов для всех авторов страницы одним запросом.
+        """
+        return self.annotate(
+            author_row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        ).filter(author_row_number__lte=limit)
+
+    def with_user_flags(self, user):
+        """Аннотация флагов is_favorited и is_in_shopping_cart."""
+        if user is None or user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+    def _uses_search_vector(self):
+        return connections[self.db].vendor == 'postgresql'
+
+    def search(self, text):
+        """Рецепты, найденные по названию, описанию и ингредиентам.
+
+        В PostgreSQL поиск идет по сохраненному вектору с индексом
+        recipe_search_vector_idx, результаты упорядочены по релевантности.
+        В остальных базах используется поиск подстроки без ранжирования.
+        """
+        if not self._uses_search_vector():
+            return self.filter(
+                Q(name__icontains=text)
+                | Q(text__icontains=text)
+                | Exists(RecipeIngredient.objects.filter(
+                    recipe_id=OuterRef('pk'),
+                    ingredient__name__icontains=text,
+                ))
+            )
+        query = SearchQuery(
+            text,
+            config=SEARCH_CONFIG,
+            search_type='websearch'
+        )
+        return self.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+    def update_search_vector(self):
+        """Пересчет поискового вектора рецептов одним UPDATE.
+
+        Название имеет наибольший вес, затем ингредиенты и описание.
+        """
+        if not self._uses_search_vector():
+            return 0
+        ingredient_names = RecipeIngredient.objects.filter(
+            recipe_id=OuterRef('pk')
+        ).order_by().values('recipe_id').annotate(
+            names=StringAgg('ingredient__name', delimiter=' ')
+        ).values('names')
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(
+                Subquery(ingredient_names),
+                weight='B',
+                config=SEARCH_CONFIG
+            )
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        ))
+
+
 class Recipe(models.Model):
     """Модель для рецептов."""
     author = models.ForeignKey(
@@ -75,6 +244,12 @@ class Recipe(models.Model):
         'Изображение',
         upload_to='recipes/images/',
     )
+    image_renditions = models.JSONField(
+        'Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         'Описание',
     )
@@ -95,11 +270,38 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx',
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -192,3 +394,144 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.recipe.name}'
+
+
+class ShoppingCartTotalQuerySet(models.QuerySet):
+    """QuerySet итогов корзины покупок."""
+
+    def apply_deltas(self, user_ids, deltas):
+        """Изменение итогов корзины пользователей на величины deltas.
+
+        deltas - словарь {id ингредиента: изменение количества}.
+        """
+        self.apply_user_deltas({user_id: deltas for user_id in user_ids})
+
+    def apply_user_deltas(self, user_deltas):
+        """Изменение итогов корзины, у каждого пользователя свое.
+
+        user_deltas - словарь {id пользователя: {id ингредиента:
+        изменение количества}}. Строки пользователей блокируются, чтобы
+        параллельные изменения корзины одного пользователя выполнялись
+        последовательно.
+        """
+        user_deltas = {
+            user_id: {
+                ingredient_id: delta
+                for ingredient_id, delta in deltas.items()
+                if delta
+            }
+            for user_id, deltas in user_deltas.items()
+        }
+        user_deltas = {
+            user_id: deltas
+            for user_id, deltas in user_deltas.items()
+            if deltas
+        }
+        if not user_deltas:
+            return
+        user_ids = sorted(user_deltas)
+        ingredient_ids = set().union(*user_deltas.values())
+        with transaction.atomic():
+            list(
+                User.objects.select_for_update().filter(
+                    pk__in=user_ids
+                ).order_by('pk').values_list('pk', flat=True)
+            )
+            existing = {
+                (total.user_id, total.ingredient_id): total
+                for total in self.filter(
+                    user_id__in=user_ids,
+                    ingredient_id__in=ingredient_ids,
+                )
+            }
+            to_create, to_update, to_delete = [], [], []
+            for user_id in user_ids:
+                for ingredient_id, delta in user_deltas[user_id].items():
+                    total = existing.get((user_id, ingredient_id))
+                    if total is None:
+                        if delta > 0:
+                            to_create.append(self.model(
+                                user_id=user_id,
+                                ingredient_id=ingredient_id,
+                                amount=delta,
+                            ))
+                        continue
+                    total.amount += delta
+                    if total.amount > 0:
+                        to_update.append(total)
+                    else:
+                        to_delete.append(total.pk)
+            if to_create:
+                self.bulk_create(to_create)
+            if to_update:
+                self.bulk_update(to_update, ['amount'])
+            if to_delete:
+                self.filter(pk__in=to_delete).delete()
+
+    def remove_cart_items(self, cart_items):
+        """Исключение строк корзины cart_items из итогов.
+
+        Изменения всех пользователей собираются одним запросом с
+        группировкой по пользователю и ингредиенту.
+        """
+        amounts = cart_items.values_list(
+            'user_id',
+            'recipe__recipeingredient__ingredient_id',
+        ).annotate(
+            total=Sum('recipe__recipeingredient__amount')
+        ).order_by()
+        user_deltas = defaultdict(dict)
+        for user_id, ingredient_id, total in amounts:
+            if ingredient_id is not None:
+                user_deltas[user_id][ingredient_id] = -total
+        self.apply_user_deltas(user_deltas)
+
+    def add_recipes(self, user_ids, recipe_ids, sign=1):
+        """Учет ингредиентов нескольких рецептов в итогах корзины."""
+        amounts = RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id').annotate(
+            total=Sum('amount')
+        ).values_list('ingredient_id', 'total').order_by()
+        self.apply_deltas(
+            user_ids,
+            {ingredient_id: sign * total for ingredient_id, total in amounts}
+        )
+
+
+class ShoppingCartTotal(models.Model):
+    """Итоговое количество ингредиента в корзине пользователя.
+
+    Поддерживается при изменении корзины и ингредиентов рецептов,
+    поэтому выгрузка списка покупок не пересчитывает суммы.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals',
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(
+        'Количество',
+    )
+
+    objects = ShoppingCartTotalQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Итог корзины покупок'
+        verbose_name_plural = 'Итоги корзин покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_total'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} - {self.ingredient} - {self.amount}'
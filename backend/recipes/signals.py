@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from recipes.autocomplete import ingredient_index
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+# Пакетная загрузка справочника, sender - модель справочника
+catalog_loaded = Signal()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(catalog_loaded, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """Сброс индекса ингредиентов при изменении справочника."""
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, **kwargs):
+    """Пересчет поискового вектора после фиксации транзакции.
+
+    К этому моменту ингредиенты рецепта уже сохранены.
+    """
+    transaction.on_commit(
+        lambda: Recipe.objects.filter(pk=instance.pk).update_search_vector()
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search_vector(sender, instance, created,
+                                            **kwargs):
+    """Пересчет поисковых векторов рецептов с переименованным ингредиентом."""
+    if created:
+        return
+    transaction.on_commit(
+        lambda: Recipe.objects.filter(Exists(
+            RecipeIngredient.objects.filter(
+                recipe_id=OuterRef('pk'),
+                ingredient_id=instance.pk,
+            )
+        )).update_search_vector()
+    )
@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from recipes.autocomplete import IngredientIndex
+from recipes.models import Ingredient, Tag
+
+
+class IngredientIndexTest(TestCase):
+    """Индекс ингредиентов в памяти процесса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Молоко', 'Мука', 'Сахар'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        self.index = IngredientIndex()
+
+    def search_names(self, prefix, version=None):
+        ingredients = self.index.search(prefix, version=version)
+        if ingredients is None:
+            return None
+        return [ingredient.name for ingredient in ingredients]
+
+    def test_search_by_prefix(self):
+        self.assertIsNone(self.search_names('м'))
+        self.index.build(version=1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search_names('м'), ['Молоко', 'Мука'])
+        self.assertEqual(self.search_names('МУ', version=1), ['Мука'])
+
+    def test_other_version(self):
+        self.index.build(version=1)
+        self.assertIsNone(self.search_names('м', version=2))
+
+    def test_invalidate(self):
+        self.index.build()
+        self.index.invalidate()
+        self.assertIsNone(self.search_names('м'))
+
+    @override_settings(INGREDIENT_INDEX_TTL=0)
+    def test_expired(self):
+        self.index.build()
+        self.assertIsNone(self.search_names('м'))
+
+
+class LoadTagsTest(TestCase):
+    """Загрузка тегов сопоставляет записи по слагу, названию и цвету."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.breakfast = Tag.objects.create(
+            name='Завтрак',
+            color='#E26C2D',
+            slug='breakfast'
+        )
+        cls.lunch = Tag.objects.create(
+            name='Обед',
+            color='#49B64E',
+            slug='lunch'
+        )
+
+    def load(self, rows, *args):
+        with tempfile.NamedTemporaryFile(
+            'w',
+            suffix='.json',
+            delete=False
+        ) as file:
+            json.dump(rows, file)
+        self.addCleanup(os.remove, file.name)
+        call_command(
+            'load_tags',
+            file.name,
+            *args,
+            stdout=StringIO(),
+            stderr=StringIO()
+        )
+
+    def tags(self):
+        return set(Tag.objects.values_list('pk', 'name', 'color', 'slug'))
+
+    def test_process_local_cache(self):
+        with self.assertRaises(CommandError):
+            self.load([])
+
+    @mock.patch(
+        'recipes.management.catalog.is_cache_shared',
+        return_value=True
+    )
+    def test_swap_and_rename(self, is_cache_shared):
+        self.load([
+            {'name': 'Обед', 'color': '#E26C2D', 'slug': 'breakfast'},
+            {'name': 'Завтрак', 'color': '#49B64E', 'slug': 'lunch'},
+            {'name': 'Ужин', 'color': '#8775D2', 'slug': 'dinner'},
+        ])
+        dinner = Tag.objects.get(slug='dinner')
+        self.assertEqual(self.tags(), {
+            (self.breakfast.pk, 'Обед', '#E26C2D', 'breakfast'),
+            (self.lunch.pk, 'Завтрак', '#49B64E', 'lunch'),
+            (dinner.pk, 'Ужин', '#8775D2', 'dinner'),
+        })
+        # Новый слаг у тега с тем же названием
+        self.load(
+            [{'name': 'Ужин', 'color': '#8775D2', 'slug': 'supper'}],
+            '--allow-local-cache'
+        )
+        self.assertEqual(
+            Tag.objects.get(pk=dinner.pk).slug,
+            'supper'
+        )
+        self.assertEqual(Tag.objects.count(), 3)
+
+    def test_conflict_rolls_back(self):
+        before = self.tags()
+        with self.assertRaises(CommandError):
+            self.load([
+                {'name': 'Завтрак', 'color': '#E26C2D', 'slug': 'morning'},
+                {'name': 'Обед', 'color': '#E26C2D', 'slug': 'lunch'},
+            ], '--allow-local-cache')
+        self.assertEqual(self.tags(), before)
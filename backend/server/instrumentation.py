@@ -0,0 +1,302 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from server.metrics import (
+    db_queries_per_request,
+    db_query_duration,
+    http_request_duration,
+    http_requests,
+    registry,
+)
+
+
+logger = logging.getLogger(__name__)
+
+SERIALIZER_TIMER = 'serializer'
+UNKNOWN_VIEW = 'unknown'
+SLOW_WINDOW_SIZE = 1000
+SLOW_MIN_SAMPLES = 100
+SLOW_RECALCULATE_EVERY = 50
+MAX_CAPTURED_QUERIES = 200
+MAX_CAPTURED_SQL_LENGTH = 2000
+PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+NUMBER_LITERAL = re.compile(r'\b\d+\b')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Показатели обработки одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.shapes = Counter()
+        self.timers = defaultdict(float)
+        self.timer_depth = Counter()
+        self.captured = None
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self.started
+
+    def add_query(self, sql, elapsed):
+        self.queries += 1
+        self.sql_time += elapsed
+        self.shapes[get_sql_shape(sql)] += 1
+        if (
+            self.captured is not None
+            and len(self.captured) < MAX_CAPTURED_QUERIES
+        ):
+            self.captured.append({
+                'sql': sql[:MAX_CAPTURED_SQL_LENGTH],
+                'ms': round(elapsed * 1000, 2),
+            })
+
+    def repeated_queries(self):
+        """Одинаковые по форме запросы, повторенные не менее порога раз."""
+        return [
+            {'sql': shape, 'count': count}
+            for shape, count in self.shapes.most_common()
+            if count >= settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+        ]
+
+
+def get_current_metrics():
+    """Показатели текущего запроса или None вне запроса."""
+    return _current.get()
+
+
+def get_sql_shape(sql):
+    """Форма запроса без чисел и с одинаковыми списками параметров.
+
+    Запросы одной формы, выполненные в цикле, признак проблемы N+1.
+    """
+    return NUMBER_LITERAL.sub('N', PLACEHOLDER_LIST.sub('%s, ...', sql))
+
+
+@contextmanager
+def timer(name):
+    """Замер времени участка обработки запроса.
+
+    Вложенные замеры с тем же именем не суммируются повторно.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    metrics.timer_depth[name] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timer_depth[name] -= 1
+        if not metrics.timer_depth[name]:
+            metrics.timers[name] += time.perf_counter() - started
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.add_query(sql, elapsed)
+        db_query_duration.observe(elapsed, alias=context['connection'].alias)
+
+
+def install_execute_wrapper(connection, **kwargs):
+    """Постоянная обертка выполнения запросов соединения.
+
+    Работает как connection.execute_wrapper(), но устанавливается один
+    раз при открытии соединения. Поэтому запросы учитываются и в
+    соединениях потоков sync_to_async, через которые асинхронные
+    представления обращаются к базе. Вне запроса обертка только
+    вызывает исходный execute.
+    """
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class SlowRequestSampler:
+    """Порог медленных запросов по перцентилю длительности представления.
+
+    Длительности последних SLOW_WINDOW_SIZE запросов хранятся для
+    каждого представления в памяти процесса, порог пересчитывается
+    каждые SLOW_RECALCULATE_EVERY запросов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(
+            lambda: deque(maxlen=SLOW_WINDOW_SIZE)
+        )
+        self._added = Counter()
+        self._thresholds = {}
+
+    def is_watched(self, view):
+        return view is not None and view.startswith(
+            tuple(settings.INSTRUMENTATION_SLOW_VIEWS)
+        )
+
+    def should_capture(self):
+        return random.random() < settings.INSTRUMENTATION_SLOW_SAMPLE_RATE
+
+    def is_slow(self, view, duration):
+        """Учет длительности и проверка превышения текущего порога."""
+        with self._lock:
+            threshold = self._thresholds.get(view)
+            durations = self._durations[view]
+            durations.append(duration)
+            self._added[view] += 1
+            if (
+                len(durations) >= SLOW_MIN_SAMPLES
+                and self._added[view] % SLOW_RECALCULATE_EVERY == 0
+            ):
+                ordered = sorted(durations)
+                self._thresholds[view] = ordered[min(
+                    len(ordered) - 1,
+                    len(ordered) * settings.INSTRUMENTATION_SLOW_PERCENTILE
+                    // 100
+                )]
+        return threshold is not None and duration >= threshold
+
+
+slow_sampler = SlowRequestSampler()
+
+
+def get_view_name(view_func, method):
+    """Имя представления, для наборов DRF вместе с действием."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    action = getattr(view_func, 'actions', {}).get(method.lower())
+    if action is None:
+        return view_class.__name__
+    return f'{view_class.__name__}.{action}'
+
+
+class InstrumentationMiddleware:
+    """Учет SQL-запросов и времени обработки каждого запроса.
+
+    Для каждого запроса считаются число и время SQL-запросов, время
+    сериализации и общее время. Результат отдается в заголовке
+    Server-Timing, пишется в лог одной JSON-строкой и учитывается в
+    метриках server.metrics. Повторяющиеся
+    запросы одной формы отмечаются как возможная проблема N+1. Для
+    выборки запросов к INSTRUMENTATION_SLOW_VIEWS сохраняется текст
+    SQL, он попадает в лог, если запрос медленнее перцентиля
+    INSTRUMENTATION_SLOW_PERCENTILE этого представления.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_execute_wrapper)
+        for connection in connections.all(initialized_only=True):
+            install_execute_wrapper(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current.set(RequestMetrics())
+        try:
+            response = self.get_response(request)
+            self._finish(request, response)
+        finally:
+            _current.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        token = _current.set(RequestMetrics())
+        try:
+            response = await self.get_response(request)
+            self._finish(request, response)
+        finally:
+            _current.reset(token)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return None
+        metrics.view = get_view_name(view_func, request.method)
+        if (
+            slow_sampler.is_watched(metrics.view)
+            and slow_sampler.should_capture()
+        ):
+            metrics.captured = []
+        return None
+
+    def _finish(self, request, response):
+        metrics = _current.get()
+        duration = metrics.duration
+        serializer_time = metrics.timers[SERIALIZER_TIMER]
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join((
+                'db;dur={:.1f};desc="{} queries"'.format(
+                    metrics.sql_time * 1000,
+                    metrics.queries
+                ),
+                f'serializer;dur={serializer_time * 1000:.1f}',
+                f'total;dur={duration * 1000:.1f}',
+            ))
+        record = {
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'view': metrics.view,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': metrics.queries,
+            'db_ms': round(metrics.sql_time * 1000, 2),
+            'serializer_ms': round(serializer_time * 1000, 2),
+        }
+        repeated = metrics.repeated_queries()
+        if repeated:
+            record['n_plus_one'] = repeated
+        logger.log(
+            logging.WARNING if repeated else logging.INFO,
+            json.dumps(record, ensure_ascii=False)
+        )
+        view = metrics.view or UNKNOWN_VIEW
+        http_requests.inc(
+            method=request.method,
+            view=view,
+            status=response.status_code
+        )
+        http_request_duration.observe(
+            duration,
+            method=request.method,
+            view=view
+        )
+        db_queries_per_request.observe(metrics.queries, view=view)
+        registry.maybe_flush()
+        if slow_sampler.is_watched(metrics.view) and slow_sampler.is_slow(
+            metrics.view,
+            duration
+        ) and metrics.captured is not None:
+            logger.warning(json.dumps(
+                dict(record, event='slow_request', sql=metrics.captured),
+                ensure_ascii=False
+            ))
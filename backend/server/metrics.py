@@ -0,0 +1,374 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_FILE_SUFFIX = '.json'
+ARCHIVE_FILE_NAME = f'archive{METRICS_FILE_SUFFIX}'
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+                '\n',
+                r'\n'
+            )
+        )
+        for name, value in labels
+    ))
+
+
+def _write_rows(path, rows):
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(rows, file)
+    os.replace(temporary_path, path)
+
+
+def _read_rows(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def archive_process(metrics_dir, pid):
+    """Перенос значений завершившегося процесса в общий архив.
+
+    Значения counter и histogram прибавляются к архиву, значения gauge
+    отбрасываются, файл процесса удаляется. Поэтому каталог не растет
+    при перезапусках воркеров, а новый процесс с тем же pid не
+    смешивается с завершившимся. Вызывается мастером gunicorn, см.
+    gunicorn.conf.py.
+    """
+    path = os.path.join(metrics_dir, f'{pid}{METRICS_FILE_SUFFIX}')
+    try:
+        rows = _read_rows(path)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError):
+        rows = []
+    archive_path = os.path.join(metrics_dir, ARCHIVE_FILE_NAME)
+    totals = defaultdict(float)
+    try:
+        archived = _read_rows(archive_path)
+    except (OSError, ValueError):
+        archived = []
+    for name, sample, labels, value in archived + rows:
+        # Имя значения gauge совпадает с именем метрики
+        if sample != name:
+            totals[(name, sample, tuple(map(tuple, labels)))] += value
+    _write_rows(
+        archive_path,
+        [
+            [name, sample, labels, value]
+            for (name, sample, labels), value in totals.items()
+        ]
+    )
+    os.remove(path)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Registry:
+    """Метрики процесса в формате Prometheus.
+
+    Значения хранятся в памяти процесса. Если задан METRICS_DIR,
+    процесс не чаще раза в METRICS_FLUSH_INTERVAL секунд записывает их
+    в свой файл в этом каталоге, а выдача суммирует файлы всех
+    процессов, поэтому метрики воркеров gunicorn не теряются. Значения
+    завершившихся воркеров переносятся в архив, см. archive_process.
+    Значения gauge учитываются только для живых процессов. Каталог
+    очищается при старте gunicorn, см. gunicorn.conf.py.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+        self._values = defaultdict(float)
+        self._flushed = 0.0
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+        self._flushed = 0.0
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector):
+        """Функция, обновляющая значения gauge перед выдачей метрик."""
+        self._collectors.append(collector)
+        return collector
+
+    def add(self, *items):
+        """Увеличение значений, items - пары (ключ, приращение)."""
+        with self._lock:
+            for key, amount in items:
+                self._values[key] += amount
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def _path(self):
+        return os.path.join(
+            settings.METRICS_DIR,
+            f'{os.getpid()}{METRICS_FILE_SUFFIX}'
+        )
+
+    def flush(self):
+        """Запись значений процесса в его файл в METRICS_DIR."""
+        if not settings.METRICS_DIR:
+            return
+        self._flushed = time.monotonic()
+        _write_rows(
+            self._path(),
+            [
+                [name, sample, labels, value]
+                for (name, sample, labels), value in self._snapshot()
+            ]
+        )
+
+    def maybe_flush(self):
+        if (
+            settings.METRICS_DIR
+            and time.monotonic() - self._flushed
+            >= settings.METRICS_FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def _read_files(self):
+        """Значения всех процессов из файлов METRICS_DIR."""
+        for entry in os.scandir(settings.METRICS_DIR):
+            if not entry.name.endswith(METRICS_FILE_SUFFIX):
+                continue
+            try:
+                if entry.name == ARCHIVE_FILE_NAME:
+                    alive = False
+                else:
+                    alive = _is_alive(
+                        int(entry.name[:-len(METRICS_FILE_SUFFIX)])
+                    )
+                rows = _read_rows(entry.path)
+            except (OSError, ValueError):
+                continue
+            for name, sample, labels, value in rows:
+                metric = self._metrics.get(name)
+                if metric is None or (metric.type == GAUGE and not alive):
+                    continue
+                yield (name, sample, tuple(map(tuple, labels))), value
+
+    def collect(self):
+        """Суммарные значения метрик по всем процессам."""
+        for collector in self._collectors:
+            collector()
+        if settings.METRICS_DIR:
+            self.flush()
+            rows = self._read_files()
+        else:
+            rows = self._snapshot()
+        totals = defaultdict(float)
+        for key, value in rows:
+            totals[key] += value
+        return totals
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        samples = defaultdict(list)
+        for (name, sample, labels), value in self.collect().items():
+            samples[name].append((sample, labels, value))
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(
+                f'# HELP {metric.family} {metric.documentation}'
+            )
+            lines.append(f'# TYPE {metric.family} {metric.type}')
+            for sample, labels, value in sorted(
+                samples[name],
+                key=metric.sort_key
+            ):
+                lines.append(
+                    f'{sample}{_format_labels(labels)} {_format_value(value)}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    @property
+    def family(self):
+        return self.name
+
+    def _labels(self, labels):
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def sort_key(self, row):
+        sample, labels, _ = row
+        return labels, sample
+
+
+class Counter(Metric):
+    type = COUNTER
+
+    @property
+    def family(self):
+        return f'{self.name}_total'
+
+    def inc(self, amount=1, **labels):
+        registry.add(
+            ((self.name, f'{self.name}_total', self._labels(labels)), amount)
+        )
+
+
+class Gauge(Metric):
+    type = GAUGE
+
+    def set(self, value, **labels):
+        registry.set((self.name, self.name, self._labels(labels)), value)
+
+
+class Histogram(Metric):
+    """Гистограмма с накопительными корзинами le, суммой и количеством."""
+    type = HISTOGRAM
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = [
+            (bound, _format_value(float(bound)))
+            for bound in tuple(buckets) + (math.inf,)
+        ]
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        registry.add(
+            *(
+                (
+                    (
+                        self.name,
+                        f'{self.name}_bucket',
+                        labels + (('le', bound_label),)
+                    ),
+                    1
+                )
+                for bound, bound_label in self.buckets
+                if value <= bound
+            ),
+            ((self.name, f'{self.name}_count', labels), 1),
+            ((self.name, f'{self.name}_sum', labels), value),
+        )
+
+    def sort_key(self, row):
+        sample, labels, _ = row
+        bound = math.inf
+        if labels and labels[-1][0] == 'le':
+            bound = float(labels[-1][1])
+            labels = labels[:-1]
+        return labels, sample != f'{self.name}_bucket', bound, sample
+
+
+http_requests = Counter(
+    'http_requests',
+    'Обработанные HTTP-запросы',
+    ('method', 'view', 'status'),
+)
+http_request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Время обработки HTTP-запроса',
+    ('method', 'view'),
+)
+db_queries_per_request = Histogram(
+    'db_queries_per_request',
+    'Число SQL-запросов на HTTP-запрос',
+    ('view',),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+db_query_duration = Histogram(
+    'db_query_duration_seconds',
+    'Время выполнения SQL-запроса',
+    ('alias',),
+    buckets=QUERY_LATENCY_BUCKETS,
+)
+db_connections_opened = Counter(
+    'db_connections_opened',
+    'Открытые соединения с базой данных',
+    ('alias',),
+)
+db_pool_connections = Gauge(
+    'db_pool_connections',
+    'Соединения пула по состоянию',
+    ('alias', 'state'),
+)
+cache_requests = Counter(
+    'cache_requests',
+    'Обращения к кешам API',
+    ('cache', 'result'),
+)
+favorites_added = Counter(
+    'foodgram_favorites_added',
+    'Рецепты, добавленные в избранное',
+)
+shopping_cart_added = Counter(
+    'foodgram_shopping_cart_added',
+    'Рецепты, добавленные в корзину покупок',
+)
+subscriptions_created = Counter(
+    'foodgram_subscriptions_created',
+    'Созданные подписки на авторов',
+)
+
+
+def record_cache(cache_name, hit):
+    cache_requests.inc(cache=cache_name, result='hit' if hit else 'miss')
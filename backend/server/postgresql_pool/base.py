@@ -0,0 +1,208 @@
+import functools
+import queue
+import threading
+import time
+
+from django.db import DatabaseError
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+
+DEFAULT_POOL_MAX_SIZE = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_CHECK_IDLE = 30
+
+
+class PoolTimeout(DatabaseError):
+    pass
+
+
+class ConnectionPool:
+    """Пул соединений с базой данных внутри процесса.
+
+    Свободные соединения хранятся в стеке, число выданных соединений
+    ограничено max_size: при исчерпании пула поток ждет освобождения
+    соединения не дольше timeout секунд. Проверка соединения перед
+    выдачей выполняется, только если оно простаивало в пуле не меньше
+    check_idle секунд.
+    """
+
+    def __init__(self, params, max_size, timeout,
+                 check_idle=DEFAULT_POOL_CHECK_IDLE):
+        self.params = params
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._counters = dict.fromkeys(
+            ('opened', 'closed', 'acquired', 'waits', 'timeouts'),
+            0
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def acquire(self, connect, check=None):
+        """Свободное соединение из пула или новое, созданное connect.
+
+        check проверяет свободное соединение, простоявшее не меньше
+        check_idle секунд, перед выдачей, непрошедшие проверку
+        соединения закрываются.
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count('timeouts')
+                raise PoolTimeout(
+                    'Нет свободных соединений с базой данных '
+                    f'за {self.timeout} с'
+                )
+        try:
+            connection = self._get_idle(check)
+            if connection is None:
+                connection = connect()
+                self._count('opened')
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._counters['acquired'] += 1
+            self._in_use += 1
+        return connection
+
+    def _get_idle(self, check):
+        while True:
+            try:
+                connection, released = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if not connection.closed and (
+                check is None
+                or time.monotonic() - released < self.check_idle
+                or check(connection)
+            ):
+                return connection
+            self._discard(connection)
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except base.Database.Error:
+            pass
+        self._count('closed')
+
+    def release(self, connection):
+        """Возврат соединения в пул с откатом незавершенной транзакции."""
+        try:
+            if connection.closed:
+                self._discard(connection)
+            else:
+                try:
+                    connection.rollback()
+                except base.Database.Error:
+                    self._discard(connection)
+                else:
+                    self._idle.put((connection, time.monotonic()))
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def close_idle(self):
+        """Закрытие всех свободных соединений."""
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                **self._counters,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, params, options):
+    """Пул соединений псевдонима базы данных.
+
+    При смене параметров подключения, например при создании тестовой
+    базы, пул создается заново.
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.params != params:
+            if pool is not None:
+                pool.close_idle()
+            pool = _pools[alias] = ConnectionPool(
+                params,
+                options.get('MAX_SIZE', DEFAULT_POOL_MAX_SIZE),
+                options.get('TIMEOUT', DEFAULT_POOL_TIMEOUT),
+                options.get('CHECK_IDLE', DEFAULT_POOL_CHECK_IDLE),
+            )
+        return pool
+
+
+def get_pool_stats(alias):
+    """Состояние пула псевдонима или None, если пул не создан."""
+    pool = _pools.get(alias)
+    return None if pool is None else pool.stats()
+
+
+def _is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.rollback()
+    except base.Database.Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Бэкенд PostgreSQL, берущий соединения из пула процесса.
+
+    При закрытии соединение возвращается в пул, поэтому CONN_MAX_AGE
+    для этого бэкенда следует оставлять равным 0. Параметры пула
+    задаются в POOL: MAX_SIZE, TIMEOUT и CHECK_IDLE. При
+    CONN_HEALTH_CHECKS соединения, простоявшие в пуле не меньше
+    CHECK_IDLE секунд, проверяются запросом SELECT 1 перед выдачей.
+    """
+
+    _connection_pool = None
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(
+            self.alias,
+            repr(sorted(conn_params.items())),
+            self.settings_dict.get('POOL', {})
+        )
+        connection = pool.acquire(
+            functools.partial(super().get_new_connection, conn_params),
+            _is_usable if self.settings_dict['CONN_HEALTH_CHECKS'] else None
+        )
+        self._connection_pool = pool
+        self.isolation_level = IsolationLevel(
+            self.settings_dict['OPTIONS'].get(
+                'isolation_level',
+                IsolationLevel.READ_COMMITTED
+            )
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self._connection_pool.release(self.connection)
@@ -0,0 +1,119 @@
+import hashlib
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+
+from api.caching import is_cache_shared
+
+
+PRIMARY_DB = 'default'
+REPLICA_DB = 'replica'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_CACHE_KEY = 'replica-sticky:{}'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def is_reading_replica():
+    """Читает ли текущий запрос с реплики."""
+    return _use_replica.get()
+
+
+class ReplicaRouter:
+    """Чтение с реплики внутри безопасных запросов, запись в основную базу.
+
+    Вне запросов, например в командах управления и фоновых потоках,
+    все запросы идут в основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        return REPLICA_DB if _use_replica.get() else PRIMARY_DB
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DB
+
+
+def _get_client_key(request):
+    """Ключ клиента по токену или сессии без обращения к базе данных."""
+    credentials = (
+        request.headers.get('Authorization')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    return STICKY_CACHE_KEY.format(
+        hashlib.sha256(credentials.encode()).hexdigest()
+    )
+
+
+class ReplicaRoutingMiddleware:
+    """Выбор базы данных для чтения на время обработки запроса.
+
+    Безопасные запросы читают с реплики. После успешного изменяющего
+    запроса клиент на REPLICA_STICKY_SECONDS закрепляется за основной
+    базой, чтобы видеть свои изменения независимо от отставания реплики.
+    Закрепление хранится в кеше, поэтому с кешем в памяти процесса
+    реплика не используется: другой воркер не увидел бы закрепления.
+    Новый токен, еще не дошедший до реплики, ищется в основной базе,
+    см. api.authentication.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        client_key = _get_client_key(request)
+        use_replica = self._can_read_replica(request) and not (
+            client_key and cache.get(client_key)
+        )
+        token = _use_replica.set(use_replica)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+        if self._is_successful_write(request, response) and client_key:
+            cache.set(client_key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        client_key = _get_client_key(request)
+        use_replica = self._can_read_replica(request) and not (
+            client_key and await cache.aget(client_key)
+        )
+        token = _use_replica.set(use_replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+        if self._is_successful_write(request, response) and client_key:
+            await cache.aset(
+                client_key,
+                True,
+                settings.REPLICA_STICKY_SECONDS
+            )
+        return response
+
+    @staticmethod
+    def _can_read_replica(request):
+        return request.method in SAFE_METHODS and is_cache_shared()
+
+    @staticmethod
+    def _is_successful_write(request, response):
+        return (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+        )
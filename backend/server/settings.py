@@ -29,6 +29,7 @@ INSTALLED_APPS = [
     'identity.apps.IdentityConfig',
     'recipes.apps.RecipesConfig',
     'api.apps.ApiConfig',
+    'imaging.apps.ImagingConfig',
 ]
 
 MIDDLEWARE = [
@@ -62,6 +63,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'server.wsgi.application'
 
+# wsgi - синхронные воркеры gunicorn, asgi - воркеры uvicorn
+# с асинхронной обработкой чтения рецептов, тегов и ингредиентов
+SERVER_MODE = config('SERVER_MODE', default='wsgi')
+ASYNC_READ_VIEWS = SERVER_MODE == 'asgi'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -74,9 +80,129 @@ DATABASES = {
         'PASSWORD': config('POSTGRES_PASSWORD'),
         'HOST': config('POSTGRES_HOST'),
         'PORT': config('POSTGRES_PORT'),
+        # В режиме asgi соединения не переиспользуются между запросами,
+        # для него предназначен пул соединений
+        'CONN_MAX_AGE': config(
+            'POSTGRES_CONN_MAX_AGE',
+            default=0 if SERVER_MODE == 'asgi' else 60,
+            cast=int
+        ),
+        'CONN_HEALTH_CHECKS': config(
+            'POSTGRES_CONN_HEALTH_CHECKS',
+            default=True,
+            cast=bool
+        ),
+    }
+}
+
+# Пул соединений внутри процесса воркера, соединение возвращается в пул
+# в конце запроса
+if config('POSTGRES_POOL', default=False, cast=bool):
+    DATABASES['default'].update({
+        'ENGINE': 'server.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': config('POSTGRES_POOL_MAX_SIZE', default=10, cast=int),
+            'TIMEOUT': config('POSTGRES_POOL_TIMEOUT', default=30, cast=int),
+            'CHECK_IDLE': config('POSTGRES_POOL_CHECK_IDLE', default=30, cast=int),
+        },
+    })
+
+# Реплика для чтения: задается хостом или именем базы, остальные
+# параметры берутся из основной базы. Для закрепления клиента за
+# основной базой нужен общий кеш: с кешем в памяти процесса реплика
+# не используется, а check --deploy сообщает об ошибке api.E001.
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)
+
+if config('POSTGRES_REPLICA_HOST', default='') or config(
+    'POSTGRES_REPLICA_DB', default=''
+):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': config(
+            'POSTGRES_REPLICA_DB',
+            default=DATABASES['default']['NAME']
+        ),
+        'HOST': config(
+            'POSTGRES_REPLICA_HOST',
+            default=DATABASES['default']['HOST']
+        ),
+        'PORT': config(
+            'POSTGRES_REPLICA_PORT',
+            default=DATABASES['default']['PORT']
+        ),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['server.replica.ReplicaRouter']
+    MIDDLEWARE.append('server.replica.ReplicaRoutingMiddleware')
+
+# Учет SQL-запросов и времени обработки запросов: заголовок
+# Server-Timing, JSON-строка в лог на каждый запрос, предупреждения
+# о проблеме N+1 и текст SQL выборки медленных запросов
+INSTRUMENTATION = config('INSTRUMENTATION', default=True, cast=bool)
+INSTRUMENTATION_SERVER_TIMING = config('INSTRUMENTATION_SERVER_TIMING', default=True, cast=bool)
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = config('INSTRUMENTATION_N_PLUS_ONE_THRESHOLD', default=5, cast=int)
+INSTRUMENTATION_SLOW_VIEWS = config(
+    'INSTRUMENTATION_SLOW_VIEWS',
+    default='RecipeViewSet,CustomUserViewSet',
+    cast=Csv()
+)
+INSTRUMENTATION_SLOW_PERCENTILE = config('INSTRUMENTATION_SLOW_PERCENTILE', default=99, cast=int)
+INSTRUMENTATION_SLOW_SAMPLE_RATE = config('INSTRUMENTATION_SLOW_SAMPLE_RATE', default=0.1, cast=float)
+
+if INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'server.instrumentation.InstrumentationMiddleware')
+
+# Метрики /api/metrics в формате Prometheus. Для нескольких воркеров
+# gunicorn задается общий каталог METRICS_DIR, в который каждый воркер
+# записывает свои значения; метрики запросов и SQL собираются
+# server.instrumentation и требуют INSTRUMENTATION. Prometheus передает
+# METRICS_TOKEN в заголовке Authorization: Bearer, без токена метрики
+# доступны только сотрудникам
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=1.0, cast=float)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'server.instrumentation': {
+            'handlers': ['console'],
+            'level': config('INSTRUMENTATION_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# По умолчанию кеш в памяти процесса, для нескольких воркеров gunicorn
+# задается общий бэкенд, например
+# django.core.cache.backends.redis.RedisCache. Через кеш воркеры и
+# команды загрузки справочников узнают о смене версии данных, с кешем
+# в памяти процесса изменения видны другим процессам только после
+# REFERENCE_CACHE_TIMEOUT и INGREDIENT_INDEX_TTL, об этом предупреждает
+# manage.py check --deploy.
+
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': config('CACHE_LOCATION', default='foodgram'),
     }
 }
 
+REFERENCE_CACHE_TIMEOUT = config('REFERENCE_CACHE_TIMEOUT', default=3600, cast=int)
+REFERENCE_CACHE_MAX_AGE = config('REFERENCE_CACHE_MAX_AGE', default=60, cast=int)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -114,6 +240,15 @@ MEDIA_URL = '/media/'
 STATIC_ROOT = '/app/static/'
 MEDIA_ROOT = '/app/media/'
 
+# Уменьшенные копии изображений создаются командой process_images.
+# Каталог очереди должен быть общим для backend и сервиса images
+IMAGE_QUEUE_DIR = config('IMAGE_QUEUE_DIR', default='/app/image_queue/')
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+IMAGE_RENDITION_FORMAT = config('IMAGE_RENDITION_FORMAT', default='WEBP')
+IMAGE_RENDITION_QUALITY = config('IMAGE_RENDITION_QUALITY', default=80, cast=int)
+IMAGE_UPLOAD_MAX_SIZE = config('IMAGE_UPLOAD_MAX_SIZE', default=10 * 2 ** 20, cast=int)
+IMAGE_UPLOAD_MAX_PIXELS = config('IMAGE_UPLOAD_MAX_PIXELS', default=40_000_000, cast=int)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -137,7 +272,7 @@ else:
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
@@ -149,6 +284,16 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Кеш аутентификации по токену: снимки токенов и пользователей в
+# памяти процесса или, при TOKEN_AUTH_SHARED_CACHE, только в общем кеше.
+# Удаление токена, смена пароля и блокировка пользователя сбрасывают
+# общий кеш сразу, а кеш в памяти - только в текущем воркере: другие
+# воркеры видят изменения не позже чем через TOKEN_AUTH_CACHE_TIMEOUT секунд
+TOKEN_AUTH_CACHE_TIMEOUT = config('TOKEN_AUTH_CACHE_TIMEOUT', default=30, cast=int)
+TOKEN_AUTH_CACHE_SIZE = config('TOKEN_AUTH_CACHE_SIZE', default=10000, cast=int)
+TOKEN_AUTH_SHARED_CACHE = config('TOKEN_AUTH_SHARED_CACHE', default=False, cast=bool)
+TOKEN_AUTH_SHARED_CACHE_TIMEOUT = config('TOKEN_AUTH_SHARED_CACHE_TIMEOUT', default=300, cast=int)
+
 ACCESS_TOKEN_LIFETIME = timedelta(minutes=int(config('ACCESS_TOKEN_LIFETIME_MINUTES')))
 REFRESH_TOKEN_LIFETIME = timedelta(days=int(config('REFRESH_TOKEN_LIFETIME_DAYS')))
 
@@ -213,3 +358,22 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
 
 DOMAIN = config('DOMAIN')
+
+INGREDIENT_SEARCH_LIMIT = config('INGREDIENT_SEARCH_LIMIT', default=50, cast=int)
+# Время жизни индекса ингредиентов в памяти воркера, после него
+# индекс перестраивается и видит изменения из других процессов
+INGREDIENT_INDEX_TTL = config('INGREDIENT_INDEX_TTL', default=300, cast=int)
+
+# Лента подписок: рецепты авторов, у которых меньше
+# FEED_FANOUT_MAX_FOLLOWERS подписчиков, записываются в ленты при
+# публикации, рецепты остальных подмешиваются при чтении. Ленты
+# хранятся только в общем кеше, с кешем в памяти процесса лента
+# строится запросом к базе при каждом чтении
+FEED_MAX_LENGTH = config('FEED_MAX_LENGTH', default=500, cast=int)
+FEED_FANOUT_MAX_FOLLOWERS = config('FEED_FANOUT_MAX_FOLLOWERS', default=1000, cast=int)
+FEED_CACHE_TIMEOUT = config('FEED_CACHE_TIMEOUT', default=10 * 60, cast=int)
+
+SHOPPING_LIST_PDF_FONT = config(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
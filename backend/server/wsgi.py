@@ -5,3 +5,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
 application = get_wsgi_application()
+
+from api.caching import get_data_version  # noqa: E402
+from recipes.autocomplete import ingredient_index  # noqa: E402
+
+ingredient_index.build_in_background(get_data_version('ingredients'))